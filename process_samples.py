@@ -1,10 +1,15 @@
+import json
 import subprocess
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
-from os import getcwd, makedirs
+from os import getcwd, makedirs, stat
 from os.path import dirname, exists
 from shutil import rmtree
 
+from scripts.downsample_fastq import frequency_error
+from scripts.frequency_store import read_frequency_matrix
+
 """
 Simple script to run through each sample and take from FASTA to quasibam
 
@@ -37,45 +42,102 @@ parser.add_argument('-fm', '--fastq-middle', default="_",
 parser.add_argument('--consensus-gap', action='store_true',
                     help=("Carry out steps to test whether gaps in consensus "
                           "contigs are merged from pipeline steps"))
+parser.add_argument('--bestref', default="kmer",
+                    choices=["kmer", "lastz", "parity"],
+                    help=("Best reference selection for --consensus-gap, "
+                          "'parity' uses lastz and reports k-mer agreement"))
 parser.add_argument('--vphaser', action='store_true',
                     help=("Run vphaser the sample set"))
 parser.add_argument('--pipeline', default=None,
                     help=("specific pipeline to be run, e.g. 'vicuna_bwa'"))
+parser.add_argument('--downsample-depth', type=int, default=None,
+                    help=("Downsample read pairs to this mean depth before "
+                          "alignment, outputs are named '_quasi_ds{depth}'"))
+parser.add_argument('--downsample-report', action='store_true',
+                    help=("Compare quasibams from --downsample-depth to the "
+                          "full depth quasibams"))
+parser.add_argument('--processes', type=int, default=None,
+                    help=("Number of Rmd reports rendered at the same time, "
+                          "defaults to rendering all reports at once"))
 
 args = parser.parse_args()
+if args.downsample_report and not args.downsample_depth:
+    parser.error("--downsample-report requires --downsample-depth")
 prefix = args.date_prefix
 fastq_middle = args.fastq_middle
 
 # Rmd reports only --
 
-if args.reports:
-    cmd = ("Rscript -e \"rmarkdown::render("
-           "'scripts/frequency-matrix_comparison.Rmd', "
-           "params = list(date_prefix = '{prefix}'), "
-           "'html_document', "
-           "'../reports/{prefix}_frequency-matrix_comparison.html')\""
-           )
-    subprocess.run(cmd.format(prefix=prefix),
-                   shell=True, check=True)
 
+def report_inputs(prefix):
+    """Size and modification time of every file read into the report cache"""
+    files = sorted(
+        glob("{directory}/data/{prefix}_*.txt".format(
+            directory=directory, prefix=prefix)) +
+        ["{directory}/scripts/helper_functions.R".format(directory=directory),
+         "{directory}/scripts/report-cache.R".format(directory=directory),
+         "{directory}/data/reference/hcv1.fas".format(directory=directory)])
+    return [[file, stat(file).st_size, stat(file).st_mtime_ns]
+            for file in files]
+
+
+def render_report(cmd):
+    # each render is a separate Rscript process, so threads only wait on it
+    subprocess.run(cmd, shell=True, check=True)
+
+
+if args.reports:
+    all_pipelines = ["vicuna_bwa", "vicuna_smalt", "iva_bwa", "iva_smalt"]
     if args.pipeline:
         pipelines = [args.pipeline]
     else:
-        pipelines = ["vicuna_bwa", "vicuna_smalt", "iva_bwa", "iva_smalt"]
+        pipelines = all_pipelines
+
+    # ROI filtered tables are built once and shared by all reports,
+    # rebuilt only when any of the input files have changed
+    cache_file = "{directory}/data/cache/{prefix}_roi.rds".format(
+        directory=directory, prefix=prefix)
+    inputs_file = cache_file.replace(".rds", "_inputs.json")
+    inputs = report_inputs(prefix)
+    cached_inputs = None
+    if exists(cache_file) and exists(inputs_file):
+        with open(inputs_file, "r") as cached:
+            cached_inputs = json.load(cached)
+    if inputs != cached_inputs:
+        print("-- Building report cache for {prefix}".format(prefix=prefix))
+        subprocess.run(["Rscript",
+                        "{directory}/scripts/report-cache.R".format(
+                            directory=directory),
+                        prefix] + all_pipelines,
+                       check=True)
+        with open(inputs_file, "w") as cached:
+            json.dump(inputs, cached)
+
+    # separate intermediates_dir so parallel renders don't share knit files
+    cmds = [("Rscript -e \"rmarkdown::render("
+             "'scripts/frequency-matrix_comparison.Rmd', "
+             "params = list(date_prefix = '{prefix}', use_cache = TRUE), "
+             "'html_document', "
+             "'../reports/{prefix}_frequency-matrix_comparison.html', "
+             "intermediates_dir = tempdir())\""
+             ).format(prefix=prefix)]
 
     for pipeline in pipelines:
         cmd = ("Rscript -e \"rmarkdown::render("
                "'scripts/quasibam-pipeline_comparison.Rmd', "
                "params = list(pipeline = '{pipeline}', "
-               "date_prefix = '{prefix}'), "
+               "date_prefix = '{prefix}', use_cache = TRUE), "
                "'html_document', "
-               "'../reports/{prefix}_{output_pipeline}_report.html')\""
+               "'../reports/{prefix}_{output_pipeline}_report.html', "
+               "intermediates_dir = tempdir())\""
                )
-        subprocess.run(
-            cmd.format(prefix=prefix,
-                       pipeline=pipeline,
-                       output_pipeline=pipeline.replace("_", "-")),
-            shell=True, check=True)
+        cmds.append(cmd.format(prefix=prefix,
+                               pipeline=pipeline,
+                               output_pipeline=pipeline.replace("_", "-")))
+
+    with ThreadPoolExecutor(max_workers=args.processes or len(cmds)) as pool:
+        # list() to raise any failed render
+        list(pool.map(render_report, cmds))
     exit()
 
 # Processing of files from fasta + fq onwards --
@@ -86,17 +148,53 @@ files = glob("{directory}/data/{prefix}_*_quasi.fas".format(
 sample_numbers = [file.split("{}_".format(prefix))[1].split("_")[0]
                   for file in files]
 
+if args.downsample_report:
+    report_file = ("{directory}/reports/{prefix}_downsample_ds{depth}.txt"
+                   ).format(directory=directory, prefix=prefix,
+                            depth=args.downsample_depth)
+    with open(report_file, "w") as output:
+        header_written = False
+        for sample_number in sorted(sample_numbers, key=int):
+            sample_prefix = "{directory}/data/{prefix}_{sample_number}".format(
+                directory=directory,
+                prefix=prefix,
+                sample_number=sample_number)
+            downsampled_file = ("{sample_prefix}_quasi_ds{depth}_sorted.txt"
+                                ).format(sample_prefix=sample_prefix,
+                                         depth=args.downsample_depth)
+            if not exists(downsampled_file):
+                print("No downsampled quasibam for sample {}".format(
+                    sample_number))
+                continue
+            summary = frequency_error(
+                read_frequency_matrix(sample_prefix + "_quasi_sorted.txt"),
+                read_frequency_matrix(downsampled_file))
+            if not header_written:
+                output.write("\t".join(["sample"] + list(summary)) + "\n")
+                header_written = True
+            output.write("\t".join(
+                ["{prefix}_{sample_number}".format(
+                    prefix=prefix, sample_number=sample_number)] +
+                [str(round(value, 4)) for value in summary.values()]))
+            output.write("\n")
+    exit()
+
 if args.consensus_gap:
     # Pretty messy conversion of bash script so tucked away in
     # another file
     for sample_number in sample_numbers:
+        downsample_args = []
+        if args.downsample_depth:
+            downsample_args = ["--downsample-depth",
+                               str(args.downsample_depth)]
         subprocess.run([
             "python3",
             "{directory}/scripts/consensus_gap.py".format(
                 directory=directory),
             "{prefix}_{sample_number}".format(
                 prefix=prefix,
-                sample_number=sample_number)],
+                sample_number=sample_number),
+            "--bestref", args.bestref] + downsample_args,
             check=True)
     exit()
 
@@ -185,10 +283,34 @@ for sample_number in sample_numbers:
     else:
         fastq_suffix = ".fq"
 
+    if args.downsample_depth:
+        print("-- Downsampling reads for sample {sample_number}".format(
+            sample_number=sample_number))
+        downsample_suffix = "_ds{depth}.fq".format(
+            depth=args.downsample_depth)
+        subprocess.run([
+            "python3",
+            "{directory}/scripts/downsample_fastq.py".format(
+                directory=directory),
+            sample_prefix + fastq_middle + "R1" + fastq_suffix,
+            sample_prefix + fastq_middle + "R2" + fastq_suffix,
+            sample_prefix + fastq_middle + "R1" +
+            fastq_suffix.replace(".fq", downsample_suffix),
+            sample_prefix + fastq_middle + "R2" +
+            fastq_suffix.replace(".fq", downsample_suffix),
+            "--depth", str(args.downsample_depth),
+            "--reference", sample_prefix + "_quasi_consensus.fas"],
+            check=True)
+        fastq_suffix = fastq_suffix.replace(".fq", downsample_suffix)
+        # keep full depth outputs, e.g. '_quasi_ds1000_sorted.bam'
+        quasi = "_quasi_ds{depth}".format(depth=args.downsample_depth)
+    else:
+        quasi = "_quasi"
+
     print("-- BWA mem for sample {sample_number}".format(
         sample_number=sample_number))
 
-    output_filename = sample_prefix + "_quasi.sam"
+    output_filename = sample_prefix + quasi + ".sam"
     with open(output_filename, "w") as output_file:
         subprocess.run(["bwa", "mem",
                         sample_prefix + "_quasi_consensus.fas",
@@ -197,26 +319,26 @@ for sample_number in sample_numbers:
                        stdout=output_file,
                        check=True)
 
-    output_filename = sample_prefix + "_quasi.bam"
+    output_filename = sample_prefix + quasi + ".bam"
     with open(output_filename, "w") as output_file:
         print("-- Converting sam to bam for sample {sample_number}".format(
             sample_number=sample_number))
         subprocess.run(["samtools", "view", "-Sb",
-                        sample_prefix + "_quasi.sam"],
+                        sample_prefix + quasi + ".sam"],
                        stdout=output_file,
                        check=True)
 
     print("-- Sorting bam for sample {sample_number}".format(
         sample_number=sample_number))
     subprocess.run(["samtools", "sort", "-f",
-                    sample_prefix + "_quasi.bam",
-                    sample_prefix + "_quasi_sorted.bam"],
+                    sample_prefix + quasi + ".bam",
+                    sample_prefix + quasi + "_sorted.bam"],
                    check=True)
 
     print("-- Indexing bam for sample {sample_number}".format(
         sample_number=sample_number))
     subprocess.run(["samtools", "index",
-                    sample_prefix + "_quasi_sorted.bam"],
+                    sample_prefix + quasi + "_sorted.bam"],
                    check=True)
 
     print("-- Running quasi_bam for sample {sample_number}".format(
@@ -225,8 +347,8 @@ for sample_number in sample_numbers:
         ["quasi_bam",
          # quasi_bam gets path prefix by splitting by ".",
          # so full path can't be given (username contains .)
-         "data/{prefix}_{sample_number}_quasi_sorted.bam".format(
-             prefix=prefix, sample_number=sample_number),
+         "data/{prefix}_{sample_number}{quasi}_sorted.bam".format(
+             prefix=prefix, sample_number=sample_number, quasi=quasi),
          "data/{prefix}_{sample_number}_quasi_consensus.fas".format(
              prefix=prefix, sample_number=sample_number),
          "-f 0.001"],
@@ -1,12 +1,20 @@
-from argparse import ArgumentParser
+from argparse import ArgumentParser, ArgumentTypeError
 from collections import defaultdict, namedtuple
 
+import numpy as np
+
 """Simple script to generate consensus sequence from multiple FASTAs
 
 - Multiple FASTAs in a single file, require an output of the most common
   sequence
 - merges all FASTAs into a dictionary of base frequency per position,
   then takes most common base per position
+- optionally makes IUPAC consensus sequences at several frequency thresholds
+  from an array of base counts per position
+- optionally writes per-position diversity (entropy, alleles above thresholds
+  and a sliding window mean of entropy) from the same base counts
+- optionally makes a pairwise distance matrix of the input haplotypes and
+  the distance of each haplotype to the consensus
 
 Tested with python 3.5.2, using pytest for unit testing
 """
@@ -57,6 +65,288 @@ def make_consensus(sequence_dict):
     return ''.join(consensus_list)
 
 
+# columns of count_table, '-' and 'N' are both counted as Gap
+count_columns = ('A', 'C', 'G', 'T', 'Gap')
+# IUPAC code for each combination of A=1, C=2, G=4, T=8
+iupac_codes = np.array(list('-ACMGRSVTWYHKDBN'))
+iupac_bits = {code: bits for bits, code in enumerate(iupac_codes)}
+
+
+def count_table(sequence_dict):
+    """Make array of base counts per position from sequence_dict
+
+    :param sequence_dict - count of each base per position:
+    :return counts - array of positions x count_columns:
+    """
+    counts = np.zeros((len(sequence_dict), len(count_columns)), dtype=np.int64)
+    for row, position_dict in enumerate(sequence_dict.values()):
+        for column, base in enumerate(count_columns[:4]):
+            counts[row, column] = position_dict.get(base, 0)
+        counts[row, 4] = position_dict.get('-', 0) + position_dict.get('N', 0)
+    return counts
+
+
+def majority_bases(sequence_dict):
+    """Most common base at each position, using the rule in make_consensus
+
+    Ties go to the base seen first at the position.
+
+    :param sequence_dict - count of each base per position:
+    :return majority - list of the most common base per position:
+    """
+    return [max(position_dict, key=position_dict.get)
+            for position_dict in sequence_dict.values()]
+
+
+def consensus_positions(sequence_dict):
+    """Positions kept in the consensus and frequency matrix
+
+    Uses the same rule as make_consensus and make_frequency_matrix, so a
+    position is dropped if '-' or 'N' on its own is the most common.
+
+    :param sequence_dict - count of each base per position:
+    :return kept - boolean array with a value per position:
+    """
+    return np.array([base not in ['-', 'N']
+                     for base in majority_bases(sequence_dict)],
+                    dtype=bool)
+
+
+def make_iupac_consensus(counts, kept, majority, thresholds):
+    """Create IUPAC consensus sequences for each frequency threshold
+
+    A base is part of the code at a position if it is present and its
+    frequency (as a percentage of all sequences, including gaps) is at least
+    the threshold. The most common base is always included, so each
+    sequence lines up with the make_consensus sequence.
+
+    :param counts - array of positions x count_columns from count_table:
+    :param kept - boolean array of positions from consensus_positions:
+    :param majority - list of most common bases from majority_bases:
+    :param thresholds - minimum percentage frequencies, e.g. [1, 5, 20]:
+    :return consensus - dictionary of threshold to consensus sequence:
+    """
+    counts = counts[kept]
+    depth = counts.sum(axis=1, keepdims=True)
+    base_frequency = 100 * counts[:, :4] / depth
+    present = counts[:, :4] > 0
+    majority_bits = np.array([iupac_bits.get(base.upper(), 0)
+                              for base, keep in zip(majority, kept) if keep],
+                             dtype=np.int64)
+    base_bits = np.array([1, 2, 4, 8])
+
+    consensus = {}
+    for threshold in thresholds:
+        included = present & (base_frequency >= threshold)
+        consensus[threshold] = ''.join(
+            iupac_codes[(included @ base_bits) | majority_bits])
+
+    return consensus
+
+
+def percentage(value):
+    """argparse type for a percentage between 0 and 100"""
+    value = float(value)
+    if not 0 <= value <= 100:
+        raise ArgumentTypeError(
+            "{} is not a percentage between 0 and 100".format(value))
+    return value
+
+
+def threshold_name(threshold):
+    """Format threshold for FASTA headers and filenames, e.g. 0.5 -> '0.5pc'"""
+    return '{:g}pc'.format(threshold)
+
+
+def write_iupac_consensus(out_file, consensus):
+    """Write one FASTA record per threshold
+
+    :param out_file - path of output FASTA:
+    :param consensus - dictionary of threshold to consensus sequence:
+    """
+    with open(out_file, "w") as output:
+        for threshold, sequence in consensus.items():
+            output.write(">consensus_{threshold}\n".format(
+                threshold=threshold_name(threshold)))
+            output.write(sequence)
+            output.write("\n")
+
+
+def shannon_entropy(counts):
+    """Shannon entropy in bits of each row of counts
+
+    :param counts - array of positions x count_columns:
+    :return entropy - array of positions:
+    """
+    depth = counts.sum(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        proportion = counts / depth
+        log_proportion = np.where(proportion > 0, np.log2(proportion), 0)
+    return np.abs(-np.sum(np.nan_to_num(proportion) * log_proportion, axis=1))
+
+
+def sliding_window_mean(values, window_size):
+    """Mean of values in a window centred on each position
+
+    Windows are cut short at each end of the sequence, as with
+    cons_mv.pl's sliding_window_size.
+
+    :param values - array of positions:
+    :param window_size - number of positions in each window:
+    :return window_mean - array of positions:
+    """
+    cumulative = np.concatenate([[0], np.cumsum(values, dtype=np.float64)])
+    positions = np.arange(len(values))
+    start = np.clip(positions - window_size // 2, 0, len(values))
+    end = np.clip(positions - window_size // 2 + window_size, 0, len(values))
+    return (cumulative[end] - cumulative[start]) / (end - start)
+
+
+def make_diversity_matrix(counts, kept, allele_thresholds=(1, 5, 20),
+                          window_size=300):
+    """Per-position diversity for the positions in the frequency matrix
+
+    :param counts - array of positions x count_columns from count_table:
+    :param kept - boolean array of positions from consensus_positions:
+    :param allele_thresholds - percentages an allele (including Gap) must
+                               reach to be counted:
+    :param window_size - positions in the sliding window of entropy:
+    :return diversity - dictionary of column name to array of positions:
+    """
+    counts = counts[kept]
+    frequency = 100 * counts / counts.sum(axis=1, keepdims=True)
+    entropy = shannon_entropy(counts)
+
+    diversity = {'Pos': np.arange(1, len(counts) + 1),
+                 'Entropy': entropy}
+    for threshold in allele_thresholds:
+        diversity['Alleles_' + threshold_name(threshold)] = np.sum(
+            (counts > 0) & (frequency >= threshold), axis=1)
+    diversity['Window_entropy'] = sliding_window_mean(entropy, window_size)
+    return diversity
+
+
+def write_diversity_matrix(out_file, diversity):
+    """Write diversity columns as a tab separated file"""
+    with open(out_file, "w") as output:
+        output.write('\t'.join(diversity))
+        output.write('\n')
+        for row in zip(*diversity.values()):
+            output.write('\t'.join(
+                [str(round(float(value), 4)) if isinstance(value, np.floating)
+                 else str(value) for value in row]))
+            output.write('\n')
+
+
+# states for encode_sequences, '-' and 'N' are both Gap as in count_table,
+# each other IUPAC code is its own state and anything else is Other
+encoded_states = ('A', 'C', 'G', 'T', 'Gap',
+                  'R', 'Y', 'S', 'W', 'K', 'M', 'B', 'D', 'H', 'V', 'Other')
+state_lookup = np.full(256, len(encoded_states) - 1, dtype=np.uint8)
+for state, bases in enumerate(['Aa', 'Cc', 'Gg', 'Tt', '-Nn'] +
+                              [code + code.lower()
+                               for code in encoded_states[5:-1]]):
+    for base in bases:
+        state_lookup[ord(base)] = state
+
+
+def read_FASTAs(sequences):
+    """Read names and sequences from FASTA records
+
+    :param sequences - open file or list of FASTA lines:
+    :return records - list of (name, sequence) tuples:
+    """
+    records = []
+    for line in sequences:
+        line = line.rstrip()
+        if line.startswith(">"):
+            records.append((line[1:].split()[0], []))
+        elif records:
+            records[-1][1].append(line)
+    return [(name, ''.join(lines)) for name, lines in records]
+
+
+def encode_sequences(sequences):
+    """Encode aligned sequences as an array of encoded_states
+
+    Sequences shorter than the longest are padded with Gap, as positions
+    missing from a sequence are not counted by merge_FASTAs.
+
+    :param sequences - list of sequence strings:
+    :return encoded - uint8 array of sequences x positions:
+    """
+    length = max([len(sequence) for sequence in sequences] + [0])
+    encoded = np.full((len(sequences), length), 4, dtype=np.uint8)
+    for row, sequence in enumerate(sequences):
+        encoded[row, :len(sequence)] = state_lookup[
+            np.frombuffer(sequence.encode('ascii'), dtype=np.uint8)]
+    return encoded
+
+
+def pairwise_distances(encoded, block_size=1000):
+    """Hamming distance between every pair of encoded sequences
+
+    Matching states are counted with a matrix product of one-hot encodings,
+    a block of positions at a time so memory stays at N x N plus
+    N x block_size per state.
+
+    :param encoded - uint8 array of sequences x positions:
+    :param block_size - number of positions per block:
+    :return distances - int array of sequences x sequences:
+    """
+    n_sequences, length = encoded.shape
+    matches = np.zeros((n_sequences, n_sequences), dtype=np.float64)
+    for start in range(0, length, block_size):
+        block = encoded[:, start:start + block_size]
+        for state in range(len(encoded_states)):
+            one_hot = (block == state).astype(np.float32)
+            matches += one_hot @ one_hot.T
+    return length - np.rint(matches).astype(np.int64)
+
+
+def consensus_distances(encoded):
+    """Hamming distance of each sequence to the most common state per position
+
+    Positions where a gap is most common are kept, so a base in a sequence at
+    a position removed from the consensus is counted as a difference.
+    Ties go to the first state in encoded_states.
+
+    :param encoded - uint8 array of sequences x positions:
+    :return distances - int array of sequences:
+    """
+    state_counts = np.stack([np.sum(encoded == state, axis=0)
+                             for state in range(len(encoded_states))])
+    majority = state_counts.argmax(axis=0)
+    return np.sum(encoded != majority, axis=1)
+
+
+def write_distances(matrix_out_file, consensus_out_file, names, encoded,
+                    p_distance=False):
+    """Write pairwise distance matrix and distance to consensus tables
+
+    :param names - list of sequence names:
+    :param encoded - uint8 array of sequences x positions:
+    :param p_distance - write matrix as proportion of positions, not counts:
+    """
+    length = encoded.shape[1]
+    distances = pairwise_distances(encoded)
+    if p_distance:
+        distances = np.round(distances / max(length, 1), 4)
+    with open(matrix_out_file, "w") as output:
+        output.write('\t'.join(['name'] + names))
+        output.write('\n')
+        for name, row in zip(names, distances):
+            output.write('\t'.join([name] + [str(value) for value in row]))
+            output.write('\n')
+
+    with open(consensus_out_file, "w") as output:
+        output.write('name\tHamming\tp_distance\n')
+        for name, distance in zip(names, consensus_distances(encoded)):
+            output.write('{name}\t{distance}\t{p_distance}\n'.format(
+                name=name, distance=distance,
+                p_distance=round(distance / max(length, 1), 4)))
+
+
 frequency = namedtuple('base', 'Pos A C G T Gap Depth RefN')
 default_frequency = frequency(None, 0, 0, 0, 0, 0, 0, None)
 
@@ -126,6 +416,31 @@ if __name__ == '__main__':
     parser.add_argument('--gap-sample', default="180212_1",
                         help=("Insert a gap into consensus sequence "
                               "using the given sample name"))
+    parser.add_argument('--iupac-thresholds', nargs='+', type=percentage,
+                        default=None,
+                        help=("Also write IUPAC consensus sequences using "
+                              "these percentage base frequency thresholds, "
+                              "e.g. '1 5 20'"))
+    parser.add_argument('--split-thresholds', action='store_true',
+                        help=("Write each IUPAC consensus to its own file "
+                              "instead of a single multi-record FASTA"))
+    parser.add_argument('--diversity', action='store_true',
+                        help=("Write per-position entropy, number of "
+                              "alleles and sliding window mean entropy"))
+    parser.add_argument('--allele-thresholds', nargs='+', type=percentage,
+                        default=[1, 5, 20],
+                        help=("Percentage frequencies for counting alleles "
+                              "with --diversity"))
+    parser.add_argument('--sliding-window-size', type=int, default=300,
+                        help=("Positions in the window for mean entropy, "
+                              "as in cons_mv.pl"))
+    parser.add_argument('--distances', action='store_true',
+                        help=("Write pairwise Hamming distances between the "
+                              "input sequences and each sequence's distance "
+                              "to the consensus"))
+    parser.add_argument('--p-distance', action='store_true',
+                        help=("Write the pairwise matrix as p-distances "
+                              "instead of Hamming distances"))
     args = parser.parse_args()
     if args.gap:
         consensus_gap = int(args.gap)
@@ -144,6 +459,17 @@ if __name__ == '__main__':
     with open(in_file, "r") as sequences:
         sequence_dict = merge_FASTAs(sequences)
         consensus = make_consensus(sequence_dict)
+        if args.iupac_thresholds or args.diversity:
+            counts = count_table(sequence_dict)
+            kept = consensus_positions(sequence_dict)
+        if args.iupac_thresholds:
+            iupac_consensus = make_iupac_consensus(
+                counts, kept, majority_bases(sequence_dict),
+                args.iupac_thresholds)
+        if args.diversity:
+            diversity = make_diversity_matrix(
+                counts, kept, args.allele_thresholds,
+                args.sliding_window_size)
         frequency_matrix = make_frequency_matrix(sequence_dict)
     # write consensus FASTA
     with open(consensus_out_file, "w") as output:
@@ -170,3 +496,33 @@ if __name__ == '__main__':
             output.write('\t'.join([str(field)
                                     for field in base_frequency]))
             output.write('\n')
+    # write IUPAC consensus FASTAs
+    if args.iupac_thresholds:
+        iupac_prefix = in_file.replace('.fas', '_iupac')
+        if args.split_thresholds:
+            for threshold, sequence in iupac_consensus.items():
+                write_iupac_consensus(
+                    "{prefix}_{threshold}_consensus.fas".format(
+                        prefix=iupac_prefix,
+                        threshold=threshold_name(threshold)),
+                    {threshold: sequence})
+        else:
+            write_iupac_consensus(
+                "{prefix}_consensus.fas".format(prefix=iupac_prefix),
+                iupac_consensus)
+    # write diversity per position
+    if args.diversity:
+        write_diversity_matrix("{prefix}_diversity.txt".format(
+            prefix=in_file.replace('.fas', '')), diversity)
+    # write distances between input sequences
+    if args.distances:
+        with open(in_file, "r") as sequences:
+            records = read_FASTAs(sequences)
+        write_distances(
+            "{prefix}_distance_matrix.txt".format(
+                prefix=in_file.replace('.fas', '')),
+            "{prefix}_consensus_distance.txt".format(
+                prefix=in_file.replace('.fas', '')),
+            [name for name, _ in records],
+            encode_sequences([sequence for _, sequence in records]),
+            p_distance=args.p_distance)
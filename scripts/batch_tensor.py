@@ -0,0 +1,336 @@
+import re
+from argparse import ArgumentParser
+from collections import namedtuple
+from glob import glob
+from os import getcwd
+from os.path import basename, exists
+
+import numpy as np
+
+from scripts.kmers import base_codes, forward_kmers
+from scripts.frequency_store import read_frequency_matrix
+
+"""Gather a whole batch of frequency matrices into samples x positions x bases
+
+- 'truth' layer is the FASTA derived frequency matrix from FASTA_consensus.py
+- 'quasi' layer is the quasibam of the reads mapped back to the consensus
+- each pipeline has its own layer from '{sample}_{pipeline}_quasibam.txt'
+- positions are indexed by the truth Pos - 1 and padded with NaN, the quasi
+  layer is already on these positions and pipeline rows are placed on them
+  by k-mers of RefN shared with truth, rows inside a pipeline indel are
+  left out
+
+Batches are saved as compressed npz files, chunked along positions so that
+loading a region only decompresses the chunks that overlap it.
+
+Run from the root of the project, e.g. python3 -m scripts.batch_tensor 171009
+"""
+
+BASES = ('A', 'C', 'G', 'T', 'Gap')
+PIPELINES = ("vicuna_bwa", "vicuna_smalt", "iva_bwa", "iva_smalt")
+
+Batch = namedtuple('Batch', 'samples refn frequencies depths')
+
+
+def batch_samples(data_directory, prefix):
+    """Sample names for a date prefix, sorted by sample number
+
+    :param data_directory - directory containing '{sample}_quasi.fas' files:
+    :param prefix - date prefix in YYMMDD:
+    :return samples - list of sample names, e.g. ['171009_1', '171009_2']:
+    """
+    samples = set()
+    for file in glob("{data_directory}/{prefix}_*_quasi*".format(
+            data_directory=data_directory, prefix=prefix)):
+        match = re.match(r"({prefix}_[0-9]+)_".format(prefix=prefix),
+                         basename(file))
+        if match:
+            samples.add(match.group(1))
+    return sorted(samples, key=lambda sample: int(sample.split("_")[1]))
+
+
+def layer_files(data_directory, sample, pipelines=PIPELINES):
+    """Input table for each layer of a sample
+
+    :return layer_file - dictionary of layer name to file path:
+    """
+    sample_prefix = "{data_directory}/{sample}".format(
+        data_directory=data_directory, sample=sample)
+    layer_file = {'truth': sample_prefix + "_quasi_frequency_matrix.txt",
+                  'quasi': sample_prefix + "_quasi_sorted.txt"}
+    for pipeline in pipelines:
+        layer_file[pipeline] = (
+            "{sample_prefix}_{pipeline}_quasibam.txt".format(
+                sample_prefix=sample_prefix, pipeline=pipeline))
+    return layer_file
+
+
+def refn_kmers(refn, k):
+    """Forward k-mer values starting at each row of a RefN column
+
+    :param refn - S1 array of reference bases:
+    :param k - k-mer length, up to 31:
+    :return kmers, valid - as from kmers.forward_kmers:
+    """
+    return forward_kmers(base_codes[np.frombuffer(
+        np.ascontiguousarray(refn, dtype='S1').tobytes(), dtype=np.uint8)], k)
+
+
+def align_positions(refn, truth_refn, k=15):
+    """Truth row matching each row of a pipeline table
+
+    Rows are anchored by k-mers of RefN that occur once in truth. Rows
+    between two anchors with the same offset (i.e. substitutions) take
+    that offset, rows inside an indel or before the first anchor are
+    left out.
+
+    :param refn - RefN column of the pipeline table:
+    :param truth_refn - RefN column of the truth table:
+    :param k - anchor k-mer length:
+    :return index - truth row for each row, -1 where there isn't one:
+    """
+    n_rows = len(refn)
+    kmers, valid = refn_kmers(refn, k)
+    truth_kmers, truth_valid = refn_kmers(truth_refn, k)
+    unique, first, counts = np.unique(truth_kmers[truth_valid],
+                                      return_index=True, return_counts=True)
+    unique_start = np.flatnonzero(truth_valid)[first][counts == 1]
+    unique = unique[counts == 1]
+    if not len(unique) or not len(kmers):
+        return np.full(n_rows, -1, dtype=np.int64)
+
+    found = np.minimum(np.searchsorted(unique, kmers), len(unique) - 1)
+    starts = np.flatnonzero(valid & (unique[found] == kmers))
+    offsets = np.zeros(n_rows, dtype=np.int64)
+    offsets[starts] = unique_start[found[starts]] - starts
+
+    # nearest anchor starting at or before, and at or after, each row
+    rows = np.arange(n_rows)
+    is_anchor = np.zeros(n_rows, dtype=bool)
+    is_anchor[starts] = True
+    previous = np.maximum.accumulate(np.where(is_anchor, rows, -1))
+    following = np.minimum.accumulate(
+        np.where(is_anchor, rows, n_rows)[::-1])[::-1]
+    previous_offset = offsets[np.maximum(previous, 0)]
+    following_offset = offsets[np.minimum(following, n_rows - 1)]
+
+    index = rows + previous_offset
+    mapped = ((previous >= 0) &
+              ((rows < previous + k) |
+               ((following < n_rows) &
+                (previous_offset == following_offset))) &
+              (index >= 0) & (index < len(truth_refn)))
+    return np.where(mapped, index, -1)
+
+
+def build_batch(data_directory, prefix, pipelines=PIPELINES):
+    """Read all tables for a date prefix into a single Batch
+
+    Missing tables (e.g. a pipeline that failed for a sample) are left as NaN,
+    as are pipeline tables for samples without a truth table to align to
+
+    :param data_directory - directory containing the tables:
+    :param prefix - date prefix in YYMMDD:
+    :param pipelines - pipeline names used in quasibam file names:
+    :return batch - Batch with arrays of samples x positions (x bases):
+    """
+    samples = batch_samples(data_directory, prefix)
+    tables = {}
+    for sample_index, sample in enumerate(samples):
+        for layer, file in layer_files(data_directory, sample,
+                                       pipelines).items():
+            if exists(file):
+                tables[(layer, sample_index)] = read_frequency_matrix(file)
+
+    n_positions = max([int(records['Pos'].max())
+                       for (layer, _), records in tables.items()
+                       if layer in ('truth', 'quasi') and len(records)] +
+                      [0])
+    layers = ['truth', 'quasi'] + list(pipelines)
+    frequencies = {layer: np.full((len(samples), n_positions, len(BASES)),
+                                  np.nan, dtype=np.float32)
+                   for layer in layers}
+    depths = {layer: np.full((len(samples), n_positions), np.nan,
+                             dtype=np.float32)
+              for layer in layers}
+    refn = np.full((len(samples), n_positions), b'', dtype='S1')
+
+    for (layer, sample_index), records in tables.items():
+        if layer in ('truth', 'quasi'):
+            index = records['Pos'].astype(np.int64) - 1
+        elif ('truth', sample_index) in tables:
+            # pipeline consensus differs from truth by any indels
+            truth = tables[('truth', sample_index)]
+            rows = align_positions(records['RefN'], truth['RefN'])
+            records = records[rows >= 0]
+            index = truth['Pos'][rows[rows >= 0]].astype(np.int64) - 1
+        else:
+            continue
+        frequencies[layer][sample_index, index] = np.stack(
+            [records[base] for base in BASES], axis=-1)
+        depths[layer][sample_index, index] = records['Depth']
+        if layer == 'truth':
+            refn[sample_index, index] = records['RefN']
+
+    return Batch(samples, refn, frequencies, depths)
+
+
+def save_batch(batch_file, batch, chunk_size=1000):
+    """Save a batch as a compressed npz, chunked along positions
+
+    :param batch_file - output path, should end in '.npz':
+    :param batch - Batch to save:
+    :param chunk_size - number of positions per chunk:
+    """
+    n_positions = batch.refn.shape[1]
+    arrays = {'samples': np.array(batch.samples),
+              'layers': np.array(list(batch.frequencies)),
+              'chunk_size': np.array(chunk_size),
+              'n_positions': np.array(n_positions)}
+    for chunk, start in enumerate(range(0, n_positions, chunk_size)):
+        end = start + chunk_size
+        arrays['refn.{}'.format(chunk)] = batch.refn[:, start:end]
+        for layer in batch.frequencies:
+            arrays['{}.frequencies.{}'.format(layer, chunk)] = (
+                batch.frequencies[layer][:, start:end])
+            arrays['{}.depths.{}'.format(layer, chunk)] = (
+                batch.depths[layer][:, start:end])
+    np.savez_compressed(batch_file, **arrays)
+
+
+def load_batch(batch_file, layers=None, start=1, end=None):
+    """Load a saved batch, optionally only some layers or positions
+
+    :param batch_file - path to npz made by save_batch:
+    :param layers - list of layer names to load, all if None:
+    :param start - 1-indexed first position:
+    :param end - 1-indexed last position, last position of batch if None:
+    :return batch - Batch covering start to end:
+    """
+    with np.load(batch_file) as saved:
+        chunk_size = int(saved['chunk_size'])
+        n_positions = int(saved['n_positions'])
+        if layers is None:
+            layers = list(saved['layers'])
+        if end is None or end > n_positions:
+            end = n_positions
+        chunks = range((start - 1) // chunk_size,
+                       (end - 1) // chunk_size + 1) if end >= start else []
+        # trim the loaded chunks down to the requested positions
+        trim = slice(start - 1 - chunks[0] * chunk_size, end - chunks[0] *
+                     chunk_size) if chunks else slice(0, 0)
+        n_samples = len(saved['samples'])
+
+        def concatenate(key, empty_shape, dtype):
+            if not chunks:
+                return np.empty(empty_shape, dtype=dtype)
+            return np.concatenate(
+                [saved[key.format(chunk)] for chunk in chunks],
+                axis=1)[:, trim]
+
+        return Batch(
+            list(saved['samples']),
+            concatenate('refn.{}', (n_samples, 0), 'S1'),
+            {layer: concatenate(layer + '.frequencies.{}',
+                                (n_samples, 0, len(BASES)), np.float32)
+             for layer in layers},
+            {layer: concatenate(layer + '.depths.{}',
+                                (n_samples, 0), np.float32)
+             for layer in layers})
+
+
+def absolute_error(batch, layer):
+    """Absolute base frequency difference from truth
+
+    :return error - samples x positions x bases, NaN where either is missing:
+    """
+    return np.abs(batch.frequencies[layer] - batch.frequencies['truth'])
+
+
+def mean_absolute_error(batch, layer):
+    """Mean absolute base frequency error per position, over samples and bases
+
+    :return error - array of positions, NaN where no sample has both tables:
+    """
+    error = absolute_error(batch, layer)
+    counts = np.sum(~np.isnan(error), axis=(0, 2))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.nansum(error, axis=(0, 2)) / counts
+
+
+def discrepancy_counts(batch, layer):
+    """Number of positions per sample where the majority base differs
+
+    :return discrepancies - array of samples:
+    """
+    truth = batch.frequencies['truth']
+    compared = batch.frequencies[layer]
+    both = ~(np.isnan(truth).any(axis=2) | np.isnan(compared).any(axis=2))
+    truth_major = np.argmax(np.where(np.isnan(truth), -1, truth), axis=2)
+    compared_major = np.argmax(np.where(np.isnan(compared), -1, compared),
+                               axis=2)
+    return np.sum(both & (truth_major != compared_major), axis=1)
+
+
+def depth_stratified_error(batch, layer, depth_bins=(0, 100, 1000, 10000)):
+    """Mean absolute base frequency error binned by the layer's depth
+
+    :param depth_bins - lower edge of each depth bin:
+    :return mean_error, positions - arrays with one value per depth bin:
+    """
+    error = absolute_error(batch, layer)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        position_error = (np.nansum(error, axis=2) /
+                          np.sum(~np.isnan(error), axis=2))
+    depth = batch.depths[layer]
+    present = ~(np.isnan(position_error) | np.isnan(depth))
+    depth_bin = np.digitize(depth[present], depth_bins) - 1
+    positions = np.bincount(depth_bin, minlength=len(depth_bins))
+    total_error = np.bincount(depth_bin, weights=position_error[present],
+                              minlength=len(depth_bins))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return total_error / positions, positions
+
+
+def write_summary(summary_file, batch, depth_bins=(0, 100, 1000, 10000)):
+    """Write whole batch error summary for each layer compared to truth"""
+    with open(summary_file, "w") as output:
+        output.write("layer\tsamples\tmean_abs_error\tdiscrepant_positions"
+                     "\tdepth_from\tdepth_positions\tdepth_mean_abs_error\n")
+        for layer in batch.frequencies:
+            if layer == 'truth':
+                continue
+            present = ~np.all(np.isnan(batch.depths[layer]), axis=1)
+            if not present.any():
+                continue
+            overall = np.nanmean(absolute_error(batch, layer))
+            discrepancies = discrepancy_counts(batch, layer).sum()
+            strata_error, strata_positions = depth_stratified_error(
+                batch, layer, depth_bins)
+            for depth_from, positions, error in zip(
+                    depth_bins, strata_positions, strata_error):
+                output.write("\t".join(str(field) for field in [
+                    layer, present.sum(), round(float(overall), 4),
+                    discrepancies, depth_from, positions,
+                    round(float(error), 4)]))
+                output.write("\n")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        description='Build a batch frequency array for a date prefix '
+                    'and write a validation summary to reports/')
+    parser.add_argument('date_prefix',
+                        help="Date prefix for samples in YYMMDD")
+    parser.add_argument('--chunk-size', type=int, default=1000,
+                        help="Positions per saved chunk")
+    args = parser.parse_args()
+
+    directory = getcwd()
+    batch = build_batch("{directory}/data".format(directory=directory),
+                        args.date_prefix)
+    save_batch("{directory}/data/{prefix}_batch.npz".format(
+        directory=directory, prefix=args.date_prefix),
+        batch, chunk_size=args.chunk_size)
+    write_summary("{directory}/reports/{prefix}_batch_summary.txt".format(
+        directory=directory, prefix=args.date_prefix), batch)
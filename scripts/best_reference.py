@@ -0,0 +1,231 @@
+from argparse import ArgumentParser
+from os import stat
+from os.path import exists
+
+import numpy as np
+
+from scripts.kmers import forward_kmers, sequence_codes, windows
+
+"""Choose the best reference for a set of contigs from a reference panel
+
+- Each reference in the panel is reduced to its set of canonical k-mer
+  minimizers, the index is saved next to the panel and only rebuilt
+  when the panel changes
+- References are ranked by containment: the proportion of the contigs'
+  minimizers that are also in the reference
+- Replaces running lastz against the whole panel with lastz_bestref.pl,
+  the 'parity' command reports whether both choose the same reference
+
+Run from the root of the project, e.g.
+python3 -m scripts.best_reference select contigs.fas hcv.fasta ref.fas
+"""
+
+# odd multiplier to spread k-mers before taking minimizers
+hash_multiplier = np.uint64(0x9E3779B97F4A7C15)
+
+
+def read_fasta(fasta_file):
+    """Read names, headers and sequences from a FASTA file
+
+    :param fasta_file - path to FASTA file:
+    :return records - list of (name, header, sequence) tuples:
+    """
+    records = []
+    with open(fasta_file, "r") as fasta:
+        for line in fasta:
+            line = line.rstrip()
+            if line.startswith(">"):
+                records.append((line[1:].split()[0], line, []))
+            elif records:
+                records[-1][2].append(line)
+    return [(name, header, ''.join(lines))
+            for name, header, lines in records]
+
+
+def canonical_kmers(sequence, k):
+    """Canonical (smaller of forward and reverse complement) k-mer values
+
+    :param sequence - DNA string:
+    :param k - k-mer length, up to 31:
+    :return kmers, valid - uint64 array of k-mers and whether each is made
+                           only of A, C, G or T:
+    """
+    codes = sequence_codes(sequence)
+    forward, valid = forward_kmers(codes, k)
+    # reverse complement k-mers, read back in forward order
+    reverse, _ = forward_kmers(np.where(codes < 4, 3 - codes, 4)[::-1], k)
+    return np.minimum(forward, reverse[::-1]), valid
+
+
+def minimizers(sequence, k=15, w=10):
+    """Set of minimizers: the lowest hashed k-mer in each window of w k-mers
+
+    :param sequence - DNA string:
+    :param k - k-mer length:
+    :param w - number of consecutive k-mers in each window:
+    :return minimizers - sorted unique uint64 array:
+    """
+    kmers, valid = canonical_kmers(sequence, k)
+    hashed = kmers * hash_multiplier
+    # k-mers with other bases can never be picked
+    hashed[~valid] = np.iinfo(np.uint64).max
+    if len(hashed) == 0:
+        return hashed
+    if len(hashed) < w:
+        chosen = hashed[[hashed.argmin()]]
+    else:
+        chosen = hashed[np.arange(len(hashed) - w + 1) +
+                        windows(hashed, w).argmin(axis=1)]
+    return np.unique(chosen[chosen != np.iinfo(np.uint64).max])
+
+
+def panel_fingerprint(panel_file):
+    """Size and modification time of the panel, to spot a changed panel"""
+    panel_stat = stat(panel_file)
+    return np.array([panel_stat.st_size, panel_stat.st_mtime_ns],
+                    dtype=np.int64)
+
+
+def build_index(panel_file, index_file, k=15, w=10):
+    """Make and save the minimizer index of a reference panel
+
+    :param panel_file - multi-record FASTA of references:
+    :param index_file - output npz path:
+    """
+    names = []
+    reference_minimizers = []
+    for name, _, sequence in read_fasta(panel_file):
+        names.append(name)
+        reference_minimizers.append(minimizers(sequence, k, w))
+    offsets = np.cumsum([0] + [len(values) for values in reference_minimizers])
+    np.savez(index_file,
+             names=np.array(names),
+             minimizers=np.concatenate(reference_minimizers +
+                                       [np.zeros(0, dtype=np.uint64)]),
+             offsets=offsets,
+             k=np.array(k),
+             w=np.array(w),
+             fingerprint=panel_fingerprint(panel_file))
+
+
+def load_index(panel_file, index_file, k=15, w=10):
+    """Load the index of a panel, rebuilding it if it is missing or stale
+
+    :return index - dictionary of index arrays:
+    """
+    if exists(index_file):
+        with np.load(index_file) as saved:
+            index = {key: saved[key] for key in saved.files}
+        if (np.array_equal(index['fingerprint'],
+                           panel_fingerprint(panel_file)) and
+                int(index['k']) == k and int(index['w']) == w):
+            return index
+    build_index(panel_file, index_file, k, w)
+    with np.load(index_file) as saved:
+        return {key: saved[key] for key in saved.files}
+
+
+def rank_references(contigs, index):
+    """Rank panel references by containment of the contigs' minimizers
+
+    :param contigs - list of contig sequences:
+    :param index - dictionary from load_index:
+    :return ranking - list of (name, containment) tuples, best first:
+    """
+    k = int(index['k'])
+    w = int(index['w'])
+    query = np.unique(np.concatenate(
+        [minimizers(contig, k, w) for contig in contigs] +
+        [np.zeros(0, dtype=np.uint64)]))
+    hits = np.isin(index['minimizers'], query).astype(np.int64)
+    # shared minimizers per reference, from the running total at each offset
+    cumulative = np.concatenate([[0], np.cumsum(hits)])
+    shared = np.diff(cumulative[index['offsets']])
+    containment = shared / max(len(query), 1)
+    # stable sort so ties keep panel order
+    order = np.argsort(-containment, kind='stable')
+    return [(str(index['names'][i]), float(containment[i])) for i in order]
+
+
+def first_fasta_name(fasta_file):
+    """Name of the first record in a FASTA file"""
+    with open(fasta_file, "r") as fasta:
+        for line in fasta:
+            if line.startswith(">"):
+                return line[1:].split()[0]
+    return None
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        description='Select the best reference for contigs from a panel '
+                    'using a saved k-mer minimizer index')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    index_parser = subparsers.add_parser(
+        'index', help=('Build the minimizer index of a reference panel, '
+                       'if it is missing or the panel has changed'))
+    index_parser.add_argument('panel_file')
+    index_parser.add_argument('--index', default=None,
+                              help="Index path, default panel + '.kmers.npz'")
+    index_parser.add_argument('-k', type=int, default=15)
+    index_parser.add_argument('-w', type=int, default=10)
+
+    select_parser = subparsers.add_parser(
+        'select', help='Write the best reference for a set of contigs')
+    select_parser.add_argument('contigs_file')
+    select_parser.add_argument('panel_file')
+    select_parser.add_argument('best_ref_fasta')
+    select_parser.add_argument('--index', default=None,
+                               help="Index path, default panel + '.kmers.npz'")
+    select_parser.add_argument('--log', default=None,
+                               help="Write the top references to this file")
+    select_parser.add_argument('-k', type=int, default=15)
+    select_parser.add_argument('-w', type=int, default=10)
+
+    parity_parser = subparsers.add_parser(
+        'parity', help=("Compare the lastz_bestref.pl reference to the "
+                        "k-mer reference and append the result to a file"))
+    parity_parser.add_argument('sample')
+    parity_parser.add_argument('lastz_ref_fasta')
+    parity_parser.add_argument('kmer_ref_fasta')
+    parity_parser.add_argument('parity_file')
+
+    args = parser.parse_args()
+
+    if args.command == 'parity':
+        lastz_name = first_fasta_name(args.lastz_ref_fasta)
+        kmer_name = first_fasta_name(args.kmer_ref_fasta)
+        agree = lastz_name == kmer_name
+        write_header = not exists(args.parity_file)
+        with open(args.parity_file, "a") as output:
+            if write_header:
+                output.write("sample\tlastz_bestref\tkmer_bestref\tagree\n")
+            output.write("{}\t{}\t{}\t{}\n".format(
+                args.sample, lastz_name, kmer_name, agree))
+        print("-- Best reference {}: lastz {}, k-mer {}".format(
+            "agrees" if agree else "differs", lastz_name, kmer_name))
+        exit()
+
+    index_file = args.index or args.panel_file + ".kmers.npz"
+    if args.command == 'index':
+        load_index(args.panel_file, index_file, args.k, args.w)
+        exit()
+
+    index = load_index(args.panel_file, index_file, args.k, args.w)
+    ranking = rank_references(
+        [sequence for _, _, sequence in read_fasta(args.contigs_file)],
+        index)
+    best_name = ranking[0][0]
+    for name, header, sequence in read_fasta(args.panel_file):
+        if name == best_name:
+            with open(args.best_ref_fasta, "w") as output:
+                output.write(header + "\n")
+                output.write(sequence + "\n")
+            break
+    if args.log:
+        with open(args.log, "w") as output:
+            output.write("reference\tcontainment\n")
+            for name, containment in ranking[:10]:
+                output.write("{}\t{}\n".format(name, round(containment, 4)))
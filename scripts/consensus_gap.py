@@ -10,6 +10,14 @@ parser = ArgumentParser(
 parser.add_argument(
     'prefix',
     help="Prefix for original sample in YYMMDD_N, N is sample number")
+parser.add_argument(
+    '--bestref', default="kmer", choices=["kmer", "lastz", "parity"],
+    help=("How to choose the best reference: 'kmer' uses a saved k-mer index "
+          "of the panel, 'lastz' runs lastz and lastz_bestref.pl against the "
+          "panel and 'parity' uses lastz but reports if k-mer agrees"))
+parser.add_argument(
+    '--downsample-depth', type=int, default=None,
+    help="Downsample read pairs to this mean depth before any alignment")
 
 args = parser.parse_args()
 prefix = args.prefix
@@ -85,6 +93,37 @@ if not exists(gap_folder):
 sample_in = "{directory}/data/{prefix}_quasi.fas".format(
     prefix=prefix,
     directory=directory)
+fastq_in = sample_in
+
+if args.downsample_depth:
+    # reads are the same for every gap size, so only downsample once
+    print("-- Downsampling reads for {prefix}".format(prefix=prefix))
+    fastq_in = "{gap_folder}/{prefix}_quasi_ds{depth}".format(
+        gap_folder=gap_folder,
+        prefix=prefix,
+        depth=args.downsample_depth)
+    subprocess.run([
+        "python3",
+        "{directory}/scripts/downsample_fastq.py".format(
+            directory=directory),
+        sample_in + "_R1.fq",
+        sample_in + "_R2.fq",
+        fastq_in + "_R1.fq",
+        fastq_in + "_R2.fq",
+        "--depth", str(args.downsample_depth)],
+        check=True)
+
+resource_prefix = ("{directory}/pipeline-resources/"
+                   ).format(directory=directory)
+
+if args.bestref != "lastz":
+    # panel index is reused by every iteration and only rebuilt
+    # when hcv.fasta changes
+    print("-- Loading k-mer index of reference panel")
+    subprocess.run([
+        "python3", "-m", "scripts.best_reference",
+        "index", resource_prefix + "hcv.fasta"],
+        check=True)
 
 # iterate through
 for sample_number, gap in zip([1, 2, 3, 4, 5, 6, 7],
@@ -103,16 +142,13 @@ for sample_number, gap in zip([1, 2, 3, 4, 5, 6, 7],
         ).format(directory=directory,
                  prefix=prefix,
                  sample_number=sample_number)
-    resource_prefix = ("{directory}/pipeline-resources/"
-                       ).format(directory=directory)
-
     subprocess.run(["cp", sample_in, sample_prefix + "_quasi.fas"],
                    check=True)
 
-    subprocess.run(["cp", sample_in + "_R1.fq",
+    subprocess.run(["cp", fastq_in + "_R1.fq",
                     sample_prefix + "_quasi_R1.fq"],
                    check=True)
-    subprocess.run(["cp", sample_in + "_R2.fq",
+    subprocess.run(["cp", fastq_in + "_R2.fq",
                     sample_prefix + "_quasi_R2.fq"],
                    check=True)
 
@@ -130,30 +166,59 @@ for sample_number, gap in zip([1, 2, 3, 4, 5, 6, 7],
             prefix=prefix)],
         check=True)
 
-    print("-- Running lastz for sample {sample_number}".format(
-        sample_number=sample_number))
+    if args.bestref in ["lastz", "parity"]:
+        print("-- Running lastz for sample {sample_number}".format(
+            sample_number=sample_number))
 
-    output_filename = sample_prefix + "_contigs.lastz"
-    with open(output_filename, "w") as output_file:
+        output_filename = sample_prefix + "_contigs.lastz"
+        with open(output_filename, "w") as output_file:
+            subprocess.run(
+                [resource_prefix + "lastz-distrib/bin/lastz",
+                 sample_prefix + "_quasi_consensus.fas[multiple]",
+                 resource_prefix + "hcv.fasta",
+                 "--ambiguous=iupac",
+                 "--format=GENERAL"],
+                stdout=output_file,
+                check=True)
+
+        print("-- Analyzing lastz for sample {sample_number}".format(
+                sample_number=sample_number))
         subprocess.run(
-            [resource_prefix + "lastz-distrib/bin/lastz",
-             sample_prefix + "_quasi_consensus.fas[multiple]",
-             resource_prefix + "hcv.fasta",
-             "--ambiguous=iupac",
-             "--format=GENERAL"],
-            stdout=output_file,
+            ["perl", "-s",
+             resource_prefix + "lastz_bestref.pl",
+             "-contig_lastz=" + sample_prefix + "_contigs.lastz",
+             "-blastdb=" + resource_prefix + "hcv.fasta",
+             "-best_ref_fasta=" + sample_prefix + "_ref.fas",
+             "-lastz_best_hit_log=" + sample_prefix + "_best_ref.log"],
             check=True)
 
-    print("-- Analyzing lastz for sample {sample_number}".format(
-            sample_number=sample_number))
-    subprocess.run(
-        ["perl", "-s",
-         resource_prefix + "lastz_bestref.pl",
-         "-contig_lastz=" + sample_prefix + "_contigs.lastz",
-         "-blastdb=" + resource_prefix + "hcv.fasta",
-         "-best_ref_fasta=" + sample_prefix + "_ref.fas",
-         "-lastz_best_hit_log=" + sample_prefix + "_best_ref.log"],
-        check=True)
+    if args.bestref in ["kmer", "parity"]:
+        print("-- Selecting best ref by k-mers for sample {sample_number}"
+              .format(sample_number=sample_number))
+        # keep the lastz outputs in parity mode
+        kmer_ref = "_ref.fas" if args.bestref == "kmer" else "_kmer_ref.fas"
+        kmer_log = ("_best_ref.log" if args.bestref == "kmer"
+                    else "_kmer_best_ref.log")
+        subprocess.run([
+            "python3", "-m", "scripts.best_reference",
+            "select",
+            sample_prefix + "_quasi_consensus.fas",
+            resource_prefix + "hcv.fasta",
+            sample_prefix + kmer_ref,
+            "--log", sample_prefix + kmer_log],
+            check=True)
+
+    if args.bestref == "parity":
+        subprocess.run([
+            "python3", "-m", "scripts.best_reference",
+            "parity",
+            "{prefix}_{sample_number}".format(prefix=prefix,
+                                              sample_number=sample_number),
+            sample_prefix + "_ref.fas",
+            sample_prefix + "_kmer_ref.fas",
+            "{gap_folder}/{prefix}_bestref_parity.txt".format(
+                gap_folder=gap_folder, prefix=prefix)],
+            check=True)
 
     print("-- Comparing contigs and best ref: {sample_number}".format(
             sample_number=sample_number))
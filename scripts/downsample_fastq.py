@@ -0,0 +1,204 @@
+import random
+import zlib
+from argparse import ArgumentParser
+from heapq import nlargest
+from itertools import chain, islice
+from math import ceil
+
+import numpy as np
+
+"""Downsample paired FASTQs to a target depth before alignment
+
+- Streams both mates together so pairs are always kept or dropped together
+- Fixed number of pairs (or a target mean depth over the genome) uses seeded
+  reservoir sampling, only the sampled pairs are held in memory
+- Fixed fraction uses a hash of the read name and seed, so needs no memory
+  and the same reads are picked every time
+
+The frequency_error function summarises how far base frequencies from the
+downsampled reads have moved from the full depth run.
+"""
+
+BASES = ('A', 'C', 'G', 'T', 'Gap')
+
+
+def read_name(header):
+    """Read name without '@', comment or '/1' '/2' mate suffix"""
+    name = header[1:].split()[0]
+    if name.endswith(("/1", "/2")):
+        name = name[:-2]
+    return name
+
+
+def read_fastq(fastq):
+    """Yield each FASTQ record as a tuple of its four lines
+
+    :param fastq - open FASTQ file:
+    """
+    fastq = iter(fastq)
+    while True:
+        record = tuple(islice(fastq, 4))
+        if not record:
+            return
+        if len(record) != 4:
+            raise ValueError("Truncated FASTQ record: {}".format(record[0]))
+        yield record
+
+
+def read_pairs(fastq_1, fastq_2):
+    """Yield matching records from both mates
+
+    :param fastq_1 - open R1 FASTQ file:
+    :param fastq_2 - open R2 FASTQ file:
+    """
+    records_2 = read_fastq(fastq_2)
+    for record_1 in read_fastq(fastq_1):
+        record_2 = next(records_2, None)
+        if (record_2 is None or
+                read_name(record_1[0]) != read_name(record_2[0])):
+            raise ValueError("R1 and R2 are out of sync at {}".format(
+                record_1[0].rstrip()))
+        yield record_1, record_2
+    if next(records_2, None) is not None:
+        raise ValueError("R2 has more reads than R1")
+
+
+def reservoir_sample(pairs, n_pairs, seed=1):
+    """Randomly sample a fixed number of pairs in a single pass
+
+    Each pair gets a random key and the pairs with the largest keys are kept,
+    so the sample is the same for a given seed. Pairs are returned in their
+    original order.
+
+    :param pairs - iterable of read pairs:
+    :param n_pairs - number of pairs to keep:
+    :param seed - random seed:
+    :return sampled_pairs - list of read pairs:
+    """
+    rng = random.Random(seed)
+    keyed_pairs = ((rng.random(), index, pair)
+                   for index, pair in enumerate(pairs))
+    sampled = nlargest(n_pairs, keyed_pairs, key=lambda keyed: keyed[0])
+    return [pair for _, _, pair in sorted(sampled, key=lambda keyed: keyed[1])]
+
+
+def hash_sample(pairs, fraction, seed=1):
+    """Yield a fraction of pairs, chosen by a hash of the read name
+
+    :param pairs - iterable of read pairs:
+    :param fraction - proportion of pairs to keep, between 0 and 1:
+    :param seed - changes which reads are picked:
+    """
+    cutoff = fraction * 2 ** 32
+    for pair in pairs:
+        key = "{}:{}".format(seed, read_name(pair[0][0])).encode()
+        if zlib.crc32(key) < cutoff:
+            yield pair
+
+
+def pairs_for_depth(depth, genome_length, read_length):
+    """Number of read pairs to give a mean depth over the genome"""
+    return ceil(depth * genome_length / (2 * read_length))
+
+
+def genome_length_from_fasta(fasta_file):
+    """Total sequence length of a FASTA file"""
+    with open(fasta_file, "r") as fasta:
+        return sum(len(line.strip()) for line in fasta
+                   if not line.startswith(">"))
+
+
+def write_pairs(pairs, out_file_1, out_file_2):
+    """Write read pairs to R1 and R2 FASTQs
+
+    :return n_pairs - number of pairs written:
+    """
+    n_pairs = 0
+    with open(out_file_1, "w") as out_1, open(out_file_2, "w") as out_2:
+        for record_1, record_2 in pairs:
+            out_1.writelines(record_1)
+            out_2.writelines(record_2)
+            n_pairs += 1
+    return n_pairs
+
+
+def frequency_error(full_records, downsampled_records):
+    """Base frequency differences between full depth and downsampled runs
+
+    Tables are matched by Pos, both are quasibam (or frequency matrix)
+    records with A C G T Gap as percentages.
+
+    :param full_records - records from the full depth run:
+    :param downsampled_records - records from the downsampled run:
+    :return summary - dictionary of summary statistics:
+    """
+    positions, full_index, downsampled_index = np.intersect1d(
+        full_records['Pos'], downsampled_records['Pos'],
+        return_indices=True)
+    full = np.stack([full_records[base][full_index]
+                     for base in BASES], axis=-1)
+    downsampled = np.stack([downsampled_records[base][downsampled_index]
+                            for base in BASES], axis=-1)
+    error = np.abs(full - downsampled)
+    summary = {'positions': len(positions),
+               'full_depth': float(np.mean(full_records['Depth'])),
+               'downsampled_depth': float(np.mean(
+                   downsampled_records['Depth'])),
+               'mean_abs_error': 0.0,
+               'p99_abs_error': 0.0,
+               'max_abs_error': 0.0,
+               'positions_over_1pc': 0}
+    if error.size:
+        summary.update({
+            'mean_abs_error': float(error.mean()),
+            'p99_abs_error': float(np.percentile(error, 99)),
+            'max_abs_error': float(error.max()),
+            'positions_over_1pc': int(np.sum(error.max(axis=1) > 1))})
+    return summary
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        description='Downsample paired FASTQs to a number of read pairs, '
+                    'mean depth or fraction of reads')
+    parser.add_argument('fastq_1')
+    parser.add_argument('fastq_2')
+    parser.add_argument('out_fastq_1')
+    parser.add_argument('out_fastq_2')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--depth', type=float,
+                        help="Target mean depth over the genome")
+    target.add_argument('--pairs', type=int,
+                        help="Number of read pairs to keep")
+    target.add_argument('--fraction', type=float,
+                        help="Fraction of read pairs to keep")
+    parser.add_argument('--reference', default=None,
+                        help=("FASTA used for the genome length when using "
+                              "--depth, otherwise --genome-length is used"))
+    parser.add_argument('--genome-length', type=int, default=9646,
+                        help="Genome length for --depth, default is hcv1")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    with open(args.fastq_1, "r") as fastq_1, \
+            open(args.fastq_2, "r") as fastq_2:
+        pairs = read_pairs(fastq_1, fastq_2)
+        if args.fraction is not None:
+            sampled_pairs = hash_sample(pairs, args.fraction, args.seed)
+        else:
+            n_pairs = args.pairs
+            if args.depth is not None:
+                genome_length = args.genome_length
+                if args.reference:
+                    genome_length = genome_length_from_fasta(args.reference)
+                first_pair = next(pairs, None)
+                if first_pair is None:
+                    n_pairs = 0
+                else:
+                    n_pairs = pairs_for_depth(args.depth, genome_length,
+                                              len(first_pair[0][1].strip()))
+                    pairs = chain([first_pair], pairs)
+            sampled_pairs = reservoir_sample(pairs, n_pairs, args.seed)
+        n_written = write_pairs(sampled_pairs,
+                                args.out_fastq_1, args.out_fastq_2)
+    print("-- Kept {} read pairs".format(n_written))
@@ -0,0 +1,227 @@
+import json
+import mmap
+from argparse import ArgumentParser
+from os.path import basename
+
+import numpy as np
+
+"""Fixed-width binary store for frequency matrices and quasibam tables
+
+- Each sample is held as a block of fixed-width records with the same
+  Pos A C G T Gap Depth RefN fields as the FASTA_consensus.py output
+- A small header holds the sample names and the location of each block,
+  records within a block are sorted by Pos so they act as the position index
+- The store is read through mmap, so querying a region only touches the
+  pages holding that region
+
+Layout: 8 byte magic, uint32 header length, JSON header, padding to an
+8 byte boundary and then all of the records.
+"""
+
+MAGIC = b"HCVFMS01"
+FIELDS = ('Pos', 'A', 'C', 'G', 'T', 'Gap', 'Depth', 'RefN')
+record_dtype = np.dtype([('Pos', '<u4'),
+                         ('A', '<f4'),
+                         ('C', '<f4'),
+                         ('G', '<f4'),
+                         ('T', '<f4'),
+                         ('Gap', '<f4'),
+                         ('Depth', '<u4'),
+                         ('RefN', 'S1')])
+
+
+def read_frequency_matrix(matrix_file):
+    """Read a frequency matrix or quasibam TSV into an array of records
+
+    Only the columns in FIELDS are kept, any other quasibam columns
+    (and the empty trailing column) are dropped. A RefN of 'Gap' is
+    stored as '-'.
+
+    :param matrix_file - path to tab separated file with a header row:
+    :return records - numpy array of record_dtype:
+    """
+    with open(matrix_file, "r") as matrix:
+        header = matrix.readline().rstrip("\r\n").split("\t")
+        columns = {field: header.index(field)
+                   for field in FIELDS if field in header}
+        rows = [line.rstrip("\r\n").split("\t")
+                for line in matrix if line.strip()]
+
+    records = np.zeros(len(rows), dtype=record_dtype)
+    for field, column in columns.items():
+        values = [row[column] for row in rows]
+        if field == 'RefN':
+            values = ['-' if value == 'Gap' else value[:1]
+                      for value in values]
+            records[field] = np.array(values, dtype='S1')
+        else:
+            records[field] = np.array(values, dtype=float)
+
+    return records
+
+
+def write_frequency_matrix(matrix_file, records):
+    """Write records back out in the FASTA_consensus.py TSV layout
+
+    A RefN stored as '-' is written as 'Gap', as get_base_frequency does.
+
+    :param matrix_file - path of output file:
+    :param records - numpy array of record_dtype:
+    """
+    with open(matrix_file, "w") as output:
+        output.write('\t'.join(FIELDS))
+        output.write('\n')
+        for record in records:
+            output.write('\t'.join(
+                [str(record['Pos'])] +
+                [str(round(float(record[base]), 2))
+                 for base in ('A', 'C', 'G', 'T', 'Gap')] +
+                [str(record['Depth']),
+                 'Gap' if record['RefN'] == b'-'
+                 else record['RefN'].decode()]))
+            output.write('\n')
+
+
+def write_store(store_file, sample_records):
+    """Write multiple samples into a single binary store
+
+    :param store_file - path of output store:
+    :param sample_records - dictionary of sample name to record array:
+    """
+    samples = {}
+    offset = 0
+    ordered_records = []
+    for sample, records in sample_records.items():
+        records = np.asarray(records, dtype=record_dtype)
+        # Pos has to be sorted for region queries
+        records = records[np.argsort(records['Pos'], kind='stable')]
+        samples[sample] = [offset, len(records)]
+        offset += len(records)
+        ordered_records.append(records)
+
+    header = json.dumps({'record_size': record_dtype.itemsize,
+                         'samples': samples}).encode()
+    data_start = len(MAGIC) + 4 + len(header)
+    padding = -data_start % 8
+
+    with open(store_file, "wb") as output:
+        output.write(MAGIC)
+        output.write(np.uint32(len(header) + padding).tobytes())
+        output.write(header)
+        output.write(b" " * padding)
+        for records in ordered_records:
+            output.write(records.tobytes())
+
+
+class FrequencyStore:
+    """Read only, memory-mapped view of a store made by write_store
+
+    Can be used as a context manager so the file is closed afterwards.
+    Arrays returned from query are views of the mapped file, copy them
+    if they are needed after the store is closed.
+    """
+
+    def __init__(self, store_file):
+        self._file = open(store_file, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0,
+                               access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(
+                "{} is not a frequency matrix store".format(store_file))
+        header_start = len(MAGIC) + 4
+        header_length = int(np.frombuffer(
+            self._mmap, dtype='<u4', count=1, offset=len(MAGIC))[0])
+        header = json.loads(
+            self._mmap[header_start:header_start + header_length].decode())
+        self._samples = header['samples']
+        n_records = sum(count for _, count in self._samples.values())
+        self._records = np.frombuffer(self._mmap, dtype=record_dtype,
+                                      count=n_records,
+                                      offset=header_start + header_length)
+
+    @property
+    def samples(self):
+        return list(self._samples)
+
+    def sample(self, sample):
+        """All records for a single sample
+
+        :param sample - sample name, e.g. '171009_1':
+        :return records - view of record_dtype array:
+        """
+        offset, count = self._samples[sample]
+        return self._records[offset:offset + count]
+
+    def query(self, sample, start, end):
+        """Records for a sample between two positions (inclusive)
+
+        :param sample - sample name, e.g. '171009_1':
+        :param start - 1-indexed start position:
+        :param end - 1-indexed end position:
+        :return records - view of record_dtype array:
+        """
+        records = self.sample(sample)
+        positions = records['Pos']
+        first = np.searchsorted(positions, start, side='left')
+        last = np.searchsorted(positions, end, side='right')
+        return records[first:last]
+
+    def close(self):
+        # drop numpy views before closing the map
+        self._records = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            # views from query are still held, map closes when they go
+            pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def sample_name(matrix_file, suffix):
+    """Sample name from a matrix file name, e.g. '171009_1'"""
+    return basename(matrix_file).replace(suffix, "")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        description='Convert frequency matrix TSVs to and from a binary '
+                    'store for random access by region')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    build_parser = subparsers.add_parser(
+        'build', help='Make a store from frequency matrix TSVs')
+    build_parser.add_argument('store_file')
+    build_parser.add_argument('matrix_files', nargs='+')
+    build_parser.add_argument(
+        '--suffix', default="_quasi_frequency_matrix.txt",
+        help="Removed from file names to give the sample name")
+
+    export_parser = subparsers.add_parser(
+        'export', help='Write a sample (or region) from a store to TSV')
+    export_parser.add_argument('store_file')
+    export_parser.add_argument('sample')
+    export_parser.add_argument('output_file')
+    export_parser.add_argument('--start', type=int, default=0)
+    export_parser.add_argument('--end', type=int,
+                               default=np.iinfo(np.uint32).max)
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        write_store(args.store_file,
+                    {sample_name(matrix_file, args.suffix):
+                     read_frequency_matrix(matrix_file)
+                     for matrix_file in args.matrix_files})
+    else:
+        with FrequencyStore(args.store_file) as store:
+            write_frequency_matrix(
+                args.output_file,
+                store.query(args.sample, args.start, args.end))
@@ -0,0 +1,47 @@
+import numpy as np
+
+"""2-bit base codes and k-mer packing shared by the numpy scripts
+
+Windows are taken with an index array rather than sliding_window_view,
+so these work with the older numpy available on the cluster's Python 3.5.
+"""
+
+# 2-bit code for each base, anything else breaks the k-mer
+base_codes = np.full(256, 4, dtype=np.uint8)
+for code, bases in enumerate(['Aa', 'Cc', 'Gg', 'Tt']):
+    for base in bases:
+        base_codes[ord(base)] = code
+
+
+def sequence_codes(sequence):
+    """2-bit code for each base of a DNA string, 4 for any other character"""
+    return base_codes[np.frombuffer(sequence.encode('ascii'),
+                                    dtype=np.uint8)]
+
+
+def windows(values, size):
+    """Every run of size consecutive values, one run per row
+
+    :param values - 1d array:
+    :param size - window length, no more than len(values):
+    :return windows - array of (len(values) - size + 1) x size:
+    """
+    return values[np.arange(size) +
+                  np.arange(len(values) - size + 1)[:, None]]
+
+
+def forward_kmers(codes, k):
+    """Forward k-mer values starting at each position
+
+    :param codes - uint8 array of 2-bit base codes from base_codes:
+    :param k - k-mer length, up to 31:
+    :return kmers, valid - uint64 array of k-mers and whether each is made
+                           only of A, C, G or T:
+    """
+    if len(codes) < k:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=bool)
+    kmer_codes = windows(codes, k)
+    valid = np.all(kmer_codes < 4, axis=1)
+    kmer_codes = np.where(kmer_codes < 4, kmer_codes, 0).astype(np.uint64)
+    shifts = np.uint64(2) * np.arange(k - 1, -1, -1, dtype=np.uint64)
+    return np.bitwise_or.reduce(kmer_codes << shifts, axis=1), valid
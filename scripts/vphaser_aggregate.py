@@ -0,0 +1,202 @@
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from os import getcwd
+from os.path import basename, exists, join
+
+import numpy as np
+
+from scripts.frequency_store import read_frequency_matrix
+
+"""Collect vphaser variant calls for a batch and score them against the FASTAs
+
+- Parses '*.fdr.var.txt' in each data/vphaser/{prefix}_{sample} directory
+  in parallel into a single columnar table of variant calls
+- Minor variants known from the FASTA frequency matrix are every base
+  (other than the consensus base) with a non-zero frequency
+- vphaser positions are on the sample's quasi consensus, which is also the
+  Pos of the frequency matrix, so calls and known variants join on
+  sample, position and allele
+- Sensitivity is binned by known frequency and precision by called frequency
+
+Run from the root of the project, e.g.
+python3 -m scripts.vphaser_aggregate 171009
+"""
+
+BASES = ('A', 'C', 'G', 'T')
+FREQUENCY_BINS = (0, 1, 2, 5, 10, 20, 50, 100)
+variant_columns = ('sample', 'position', 'allele', 'consensus', 'type',
+                   'frequency', 'strand_bias_pval')
+
+
+def parse_vphaser(vphaser_dir):
+    """Read the variant calls from one vphaser output directory
+
+    :param vphaser_dir - e.g. 'data/vphaser/171009_1':
+    :return variants - dictionary of variant_columns to lists:
+    """
+    sample = basename(vphaser_dir.rstrip("/"))
+    variants = {column: [] for column in variant_columns}
+    for var_file in sorted(glob(join(vphaser_dir, "*.fdr.var.txt"))):
+        with open(var_file, "r") as var_table:
+            for line in var_table:
+                # header and comment lines both start with '#'
+                if line.startswith("#") or not line.strip():
+                    continue
+                fields = line.rstrip("\r\n").split("\t")
+                variants['sample'].append(sample)
+                variants['position'].append(int(fields[0]))
+                variants['allele'].append(fields[1])
+                variants['consensus'].append(fields[2])
+                variants['strand_bias_pval'].append(float(fields[3]))
+                variants['type'].append(fields[4])
+                variants['frequency'].append(float(fields[5]))
+    return variants
+
+
+def aggregate_vphaser(vphaser_dirs, processes=None):
+    """Parse vphaser directories in parallel into one columnar table
+
+    :param vphaser_dirs - list of vphaser output directories:
+    :param processes - number of worker processes, all cores if None:
+    :return variants - dictionary of variant_columns to numpy arrays:
+    """
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        parsed = list(pool.map(parse_vphaser, vphaser_dirs))
+    variants = {column: [] for column in variant_columns}
+    for sample_variants in parsed:
+        for column in variant_columns:
+            variants[column].extend(sample_variants[column])
+    return {'sample': np.array(variants['sample'], dtype=str),
+            'position': np.array(variants['position'], dtype=np.int64),
+            'allele': np.array(variants['allele'], dtype=str),
+            'consensus': np.array(variants['consensus'], dtype=str),
+            'type': np.array(variants['type'], dtype=str),
+            'frequency': np.array(variants['frequency'], dtype=np.float64),
+            'strand_bias_pval': np.array(variants['strand_bias_pval'],
+                                         dtype=np.float64)}
+
+
+def known_variants(frequency_matrices):
+    """Minor variants present in the FASTA frequency matrices
+
+    :param frequency_matrices - dictionary of sample to frequency matrix
+                                records from read_frequency_matrix:
+    :return variants - dictionary of sample, position, allele and
+                       frequency arrays:
+    """
+    samples, positions, alleles, frequencies = [], [], [], []
+    for sample, records in frequency_matrices.items():
+        for base in BASES:
+            present = ((records[base] > 0) &
+                       (records['RefN'] != base.encode()))
+            samples.append(np.full(present.sum(), sample))
+            positions.append(records['Pos'][present].astype(np.int64))
+            alleles.append(np.full(present.sum(), base))
+            frequencies.append(records[base][present].astype(np.float64))
+    return {'sample': np.concatenate(samples + [np.zeros(0, dtype=str)]),
+            'position': np.concatenate(positions +
+                                       [np.zeros(0, dtype=np.int64)]),
+            'allele': np.concatenate(alleles + [np.zeros(0, dtype=str)]),
+            'frequency': np.concatenate(frequencies + [np.zeros(0)])}
+
+
+def variant_keys(variants, samples, max_position):
+    """Single integer key per sample, position and allele for joining
+
+    Alleles that aren't A, C, G or T get a key of -1
+    """
+    sample_index = np.searchsorted(samples, variants['sample'])
+    allele_index = np.full(len(variants['allele']), -1, dtype=np.int64)
+    for index, base in enumerate(BASES):
+        allele_index[variants['allele'] == base] = index
+    keys = ((sample_index * (max_position + 1) + variants['position']) *
+            len(BASES) + allele_index)
+    keys[allele_index < 0] = -1
+    return keys
+
+
+def score_variants(called, known, bins=FREQUENCY_BINS):
+    """Sensitivity by known frequency and precision by called frequency
+
+    Only snp calls from samples that have a frequency matrix are scored.
+
+    :param called - table from aggregate_vphaser:
+    :param known - table from known_variants:
+    :param bins - edges of the percentage frequency bins:
+    :return summary - dictionary of arrays with one value per bin:
+    """
+    samples = np.unique(known['sample'])
+    scored = (called['type'] == 'snp') & np.isin(called['sample'], samples)
+    called = {column: values[scored] for column, values in called.items()}
+    max_position = max([0] + [int(variants['position'].max())
+                              for variants in (called, known)
+                              if len(variants['position'])])
+    called_keys = variant_keys(called, samples, max_position)
+    known_keys = variant_keys(known, samples, max_position)
+
+    detected = np.isin(known_keys, called_keys)
+    true_call = np.isin(called_keys, known_keys)
+    n_bins = len(bins) - 1
+    known_bin = np.clip(np.digitize(known['frequency'], bins) - 1,
+                        0, n_bins - 1)
+    called_bin = np.clip(np.digitize(called['frequency'], bins) - 1,
+                         0, n_bins - 1)
+
+    summary = {
+        'bin_from': np.array(bins[:-1]),
+        'bin_to': np.array(bins[1:]),
+        'known_variants': np.bincount(known_bin, minlength=n_bins),
+        'detected': np.bincount(known_bin, weights=detected,
+                                minlength=n_bins).astype(np.int64),
+        'calls': np.bincount(called_bin, minlength=n_bins),
+        'true_calls': np.bincount(called_bin, weights=true_call,
+                                  minlength=n_bins).astype(np.int64)}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        summary['sensitivity'] = (summary['detected'] /
+                                  summary['known_variants'])
+        summary['precision'] = summary['true_calls'] / summary['calls']
+    return summary
+
+
+def write_table(out_file, table):
+    """Write a dictionary of equal length arrays as a tab separated file"""
+    with open(out_file, "w") as output:
+        output.write('\t'.join(table))
+        output.write('\n')
+        for row in zip(*table.values()):
+            output.write('\t'.join(
+                [str(round(float(value), 4)) if isinstance(value, np.floating)
+                 else str(value) for value in row]))
+            output.write('\n')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        description='Collect vphaser calls for a date prefix and score them '
+                    'against the FASTA frequency matrices')
+    parser.add_argument('date_prefix',
+                        help="Date prefix for samples in YYMMDD")
+    parser.add_argument('--processes', type=int, default=None,
+                        help="Number of parsing processes, default all cores")
+    args = parser.parse_args()
+
+    directory = getcwd()
+    prefix = args.date_prefix
+    vphaser_dirs = sorted(glob("{directory}/data/vphaser/{prefix}_*".format(
+        directory=directory, prefix=prefix)))
+    called = aggregate_vphaser(vphaser_dirs, args.processes)
+
+    frequency_matrices = {}
+    for vphaser_dir in vphaser_dirs:
+        sample = basename(vphaser_dir)
+        matrix_file = "{directory}/data/{sample}_quasi_frequency_matrix.txt"\
+            .format(directory=directory, sample=sample)
+        if exists(matrix_file):
+            frequency_matrices[sample] = read_frequency_matrix(matrix_file)
+
+    write_table("{directory}/reports/{prefix}_vphaser_variants.txt".format(
+        directory=directory, prefix=prefix), called)
+    write_table("{directory}/reports/{prefix}_vphaser_summary.txt".format(
+        directory=directory, prefix=prefix),
+        score_variants(called, known_variants(frequency_matrices)))
@@ -1,5 +1,7 @@
 from collections import namedtuple
 
+import numpy as np
+
 from scripts import FASTA_consensus
 
 
@@ -171,3 +173,177 @@ class TestMakeFrequencyMatrix:
         output = [freq1, freq2]
 
         assert FASTA_consensus.make_frequency_matrix(input_dict) == output
+
+
+class TestCountTable:
+    def test_gap_merge(self):
+        input_dict = {
+            0: {'C': 2, 'A': 1},
+            1: {'A': 2, 'C': 3, 'G': 4, 'T': 5, '-': 6, 'N': 7},
+        }
+        output = [[1, 2, 0, 0, 0],
+                  [2, 3, 4, 5, 13]]
+
+        assert FASTA_consensus.count_table(input_dict).tolist() == output
+
+
+class TestConsensusPositions:
+    def test_gaps_counted_separately(self):
+        input_dict = {
+            0: {'A': 3, '-': 2, 'N': 2},
+            1: {'C': 1, '-': 2},
+            2: {'N': 3},
+            }
+
+        assert FASTA_consensus.consensus_positions(
+            input_dict).tolist() == [True, False, False]
+
+
+class TestMakeIUPACConsensus:
+    def test_thresholds(self):
+        counts = np.array([[100, 0, 0, 0, 0],
+                           [90, 0, 8, 2, 0],
+                           [0, 70, 0, 30, 0],
+                           [0, 1, 0, 1, 98],
+                           [0, 0, 99, 0, 1]])
+        kept = np.array([True, True, True, False, True])
+        majority = ['A', 'A', 'C', '-', 'G']
+        output = {1: "ADYG",
+                  5: "ARYG",
+                  50: "AACG"}
+
+        assert FASTA_consensus.make_iupac_consensus(
+            counts, kept, majority, [1, 5, 50]) == output
+
+    def test_all_bases(self):
+        counts = np.array([[25, 25, 25, 25, 0]])
+
+        assert FASTA_consensus.make_iupac_consensus(
+            counts, np.array([True]), ['A'], [20]) == {20: "N"}
+
+    def test_zero_threshold_skips_absent_bases(self):
+        counts = np.array([[10, 0, 0, 0, 0],
+                           [5, 0, 0, 1, 0]])
+
+        assert FASTA_consensus.make_iupac_consensus(
+            counts, np.array([True, True]), ['A', 'A'], [0]) == {0: "AW"}
+
+    def test_matches_make_consensus(self):
+        input_dict = {
+            1: {'A': 3},
+            2: {'C': 1, '-': 2},
+            3: {'T': 1, 'A': 2},
+            4: {'G': 2},
+            5: {'A': 1},
+            6: {'A': 3, '-': 2, 'N': 2},
+            7: {'C': 5},
+            8: {'T': 2, 'A': 2},
+            }
+        counts = FASTA_consensus.count_table(input_dict)
+        kept = FASTA_consensus.consensus_positions(input_dict)
+        majority = FASTA_consensus.majority_bases(input_dict)
+
+        assert FASTA_consensus.make_iupac_consensus(
+            counts, kept, majority, [60])[60][-1] == "T"
+        assert (FASTA_consensus.make_iupac_consensus(
+            counts, kept, majority, [100])[100] ==
+            FASTA_consensus.make_consensus(input_dict))
+
+
+class TestReadFASTAs:
+    def test_multiline(self):
+        sequences = [">seq1 description", "ACT", "G",
+                     ">seq2", "AATG",
+                     ]
+        output = [("seq1", "ACTG"), ("seq2", "AATG")]
+
+        assert FASTA_consensus.read_FASTAs(sequences) == output
+
+
+class TestEncodeSequences:
+    def test_gap_merge_and_padding(self):
+        output = [[0, 1, 2, 3, 4, 4],
+                  [0, 4, 5, 4, 4, 4]]
+
+        assert FASTA_consensus.encode_sequences(
+            ["ACGT-N", "aNR-"]).tolist() == output
+
+
+class TestPairwiseDistances:
+    def test_distances(self):
+        encoded = FASTA_consensus.encode_sequences(["ACGT", "ACGA",
+                                                    "A-CA", "ANCA"])
+        output = [[0, 1, 3, 3],
+                  [1, 0, 2, 2],
+                  [3, 2, 0, 0],
+                  [3, 2, 0, 0]]
+
+        assert FASTA_consensus.pairwise_distances(
+            encoded, block_size=3).tolist() == output
+
+    def test_ambiguity_codes_differ(self):
+        encoded = FASTA_consensus.encode_sequences(["AR", "AY", "Ar", "AX"])
+        output = [[0, 1, 0, 1],
+                  [1, 0, 1, 1],
+                  [0, 1, 0, 1],
+                  [1, 1, 1, 0]]
+
+        assert FASTA_consensus.pairwise_distances(
+            encoded).tolist() == output
+
+    def test_matches_direct_comparison(self):
+        rng = np.random.RandomState(1)
+        encoded = rng.randint(0, len(FASTA_consensus.encoded_states),
+                              size=(20, 55)).astype(np.uint8)
+        output = (encoded[:, None, :] != encoded[None, :, :]).sum(axis=2)
+
+        assert np.array_equal(
+            FASTA_consensus.pairwise_distances(encoded, block_size=7), output)
+
+
+class TestConsensusDistances:
+    def test_distances(self):
+        encoded = FASTA_consensus.encode_sequences(["ACGT", "ACGA",
+                                                    "A-GA", "ANCA"])
+
+        assert FASTA_consensus.consensus_distances(
+            encoded).tolist() == [1, 0, 1, 2]
+
+
+class TestShannonEntropy:
+    def test_entropy(self):
+        counts = np.array([[4, 0, 0, 0, 0],
+                           [2, 2, 0, 0, 0],
+                           [1, 1, 1, 1, 0]])
+
+        np.testing.assert_allclose(
+            FASTA_consensus.shannon_entropy(counts), [0, 1, 2])
+
+
+class TestSlidingWindowMean:
+    def test_window(self):
+        values = np.array([0, 3, 6, 9, 12])
+
+        np.testing.assert_allclose(
+            FASTA_consensus.sliding_window_mean(values, 3),
+            [1.5, 3, 6, 9, 10.5])
+
+
+class TestMakeDiversityMatrix:
+    def test_columns(self):
+        counts = np.array([[98, 2, 0, 0, 0],
+                           [0, 0, 0, 0, 10],
+                           [50, 0, 40, 0, 10]])
+        kept = np.array([True, False, True])
+
+        diversity = FASTA_consensus.make_diversity_matrix(
+            counts, kept, allele_thresholds=[1, 5], window_size=2)
+
+        assert list(diversity) == ['Pos', 'Entropy', 'Alleles_1pc',
+                                   'Alleles_5pc', 'Window_entropy']
+        assert diversity['Pos'].tolist() == [1, 2]
+        assert diversity['Alleles_1pc'].tolist() == [2, 3]
+        assert diversity['Alleles_5pc'].tolist() == [1, 3]
+        np.testing.assert_allclose(diversity['Window_entropy'],
+                                   [diversity['Entropy'][0],
+                                    diversity['Entropy'].mean()])
@@ -0,0 +1,126 @@
+import numpy as np
+import pytest
+
+from scripts import batch_tensor
+
+
+header = "Pos\tA\tC\tG\tT\tGap\tDepth\tRefN\n"
+truth_sequence = "GACTAAACCTGTCCGCTGAAACTGAGCGGGGTACTGCAGCCGATGTATCT"
+# pipeline consensus with 'TT' inserted after position 25
+pipeline_sequence = truth_sequence[:25] + "TT" + truth_sequence[25:]
+
+
+def table(sequence, depth, rows=()):
+    """Table with 100% of each RefN base, rows replaces the first lines"""
+    lines = ["{}\t{}\t{}\t{}".format(
+        pos, "\t".join("100.0" if base == refn else "0"
+                       for base in "ACGT-"), depth, refn)
+        for pos, refn in enumerate(sequence, 1)]
+    lines[:len(rows)] = rows
+    return header + "\n".join(lines) + "\n"
+
+
+@pytest.fixture
+def data_directory(tmpdir):
+    for sample in ["171009_1", "171009_2", "171009_10"]:
+        tmpdir.join(sample + "_quasi_frequency_matrix.txt").write(
+            table(truth_sequence, 10,
+                  ["1\t0\t0\t100.0\t0\t0\t10\tG",
+                   "2\t80.0\t20.0\t0\t0\t0\t10\tA"]))
+    tmpdir.join("171009_1_vicuna_bwa_quasibam.txt").write(
+        table(pipeline_sequence, 2000,
+              ["1\t10.0\t0\t90.0\t0\t0\t50\tG",
+               "2\t40.0\t60.0\t0\t0\t0\t2000\tA"]))
+    tmpdir.join("170908_1_quasi_frequency_matrix.txt").write(header)
+    return str(tmpdir)
+
+
+@pytest.fixture
+def batch(data_directory):
+    return batch_tensor.build_batch(data_directory, "171009",
+                                    pipelines=["vicuna_bwa"])
+
+
+class TestBuildBatch:
+    def test_samples_sorted_by_number(self, data_directory):
+        assert (batch_tensor.batch_samples(data_directory, "171009") ==
+                ["171009_1", "171009_2", "171009_10"])
+
+    def test_shapes(self, batch):
+        assert batch.frequencies['truth'].shape == (3, 50, 5)
+        assert batch.depths['vicuna_bwa'].shape == (3, 50)
+        assert batch.refn[0].tobytes().decode() == truth_sequence
+
+    def test_pipeline_aligned_to_truth(self, batch):
+        # positions after the insertion are moved back onto truth
+        np.testing.assert_array_equal(
+            np.argmax(batch.frequencies['vicuna_bwa'][0, 2:], axis=1),
+            np.argmax(batch.frequencies['truth'][0, 2:], axis=1))
+        assert not np.isnan(batch.depths['vicuna_bwa'][0]).any()
+
+    def test_missing_layer_is_nan(self, batch):
+        assert np.isnan(batch.frequencies['vicuna_bwa'][1]).all()
+        assert np.isnan(batch.depths['quasi']).all()
+
+
+class TestSaveLoad:
+    def test_round_trip(self, batch, tmpdir):
+        batch_file = str(tmpdir.join("batch.npz"))
+        batch_tensor.save_batch(batch_file, batch, chunk_size=2)
+        loaded = batch_tensor.load_batch(batch_file)
+
+        assert loaded.samples == batch.samples
+        assert np.array_equal(loaded.refn, batch.refn)
+        np.testing.assert_array_equal(loaded.frequencies['truth'],
+                                      batch.frequencies['truth'])
+
+    def test_region(self, batch, tmpdir):
+        batch_file = str(tmpdir.join("batch.npz"))
+        batch_tensor.save_batch(batch_file, batch, chunk_size=2)
+        loaded = batch_tensor.load_batch(batch_file, layers=['truth'],
+                                         start=2, end=3)
+
+        assert list(loaded.frequencies) == ['truth']
+        np.testing.assert_array_equal(loaded.frequencies['truth'],
+                                      batch.frequencies['truth'][:, 1:3])
+
+
+class TestStatistics:
+    def test_mean_absolute_error(self, batch):
+        error = batch_tensor.mean_absolute_error(batch, 'vicuna_bwa')
+
+        np.testing.assert_allclose(error, [4, 16] + [0] * 48)
+
+    def test_discrepancy_counts(self, batch):
+        assert list(batch_tensor.discrepancy_counts(
+            batch, 'vicuna_bwa')) == [1, 0, 0]
+
+    def test_depth_stratified_error(self, batch):
+        error, positions = batch_tensor.depth_stratified_error(
+            batch, 'vicuna_bwa', depth_bins=(0, 1000))
+
+        assert list(positions) == [1, 49]
+        np.testing.assert_allclose(error, [4, 16 / 49])
+
+
+class TestAlignPositions:
+    def test_indels_and_substitution(self):
+        truth = (truth_sequence + "TACAGCCTGAATGAACGATCAATCCGCCCC"
+                                  "CTGTAATTATAAAGGTTATCCGACCACAGG")
+        # 'TT' inserted after 25, 'A' for 'C' at 41 and 'T' at 71 deleted
+        pipeline = truth[:25] + "TT" + truth[25:40] + "A" + truth[41:70] + \
+            truth[71:]
+        index = batch_tensor.align_positions(
+            np.frombuffer(pipeline.encode(), dtype='S1'),
+            np.frombuffer(truth.encode(), dtype='S1'))
+
+        expected = (list(range(25)) + [-1, -1] + list(range(25, 70)) +
+                    list(range(71, 110)))
+        assert index.tolist() == expected
+
+    def test_no_shared_kmers(self):
+        index = batch_tensor.align_positions(
+            np.frombuffer(b"ACGT", dtype='S1'),
+            np.frombuffer(b"ACGT", dtype='S1'))
+
+        assert index.tolist() == [-1] * 4
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from scripts import best_reference
+
+
+def reverse_complement(sequence):
+    return sequence[::-1].translate(str.maketrans("ACGT", "TGCA"))
+
+
+@pytest.fixture
+def panel_file(tmpdir):
+    rng = np.random.RandomState(0)
+    references = ["".join(rng.choice(list("ACGT"), 600)) for _ in range(3)]
+    panel = tmpdir.join("hcv.fasta")
+    panel.write("".join(">ref{} genotype {}\n{}\n{}\n".format(
+        number, number, reference[:300], reference[300:])
+        for number, reference in enumerate(references)))
+    return str(panel), references
+
+
+class TestCanonicalKmers:
+    def test_reverse_complement_matches(self):
+        kmers, _ = best_reference.canonical_kmers("ACGTTGCA", 4)
+        reverse_kmers, _ = best_reference.canonical_kmers(
+            reverse_complement("ACGTTGCA"), 4)
+
+        assert sorted(kmers) == sorted(reverse_kmers)
+
+    def test_values(self):
+        kmers, valid = best_reference.canonical_kmers("AACN", 2)
+
+        # AA = 0, AC = 1, CN is invalid
+        assert kmers[:2].tolist() == [0, 1]
+        assert valid.tolist() == [True, True, False]
+
+    def test_short_sequence(self):
+        kmers, valid = best_reference.canonical_kmers("ACG", 4)
+
+        assert len(kmers) == 0 and len(valid) == 0
+
+
+class TestMinimizers:
+    def test_strand_independent(self, panel_file):
+        _, references = panel_file
+
+        assert np.array_equal(
+            best_reference.minimizers(references[0]),
+            best_reference.minimizers(reverse_complement(references[0])))
+
+    def test_no_valid_kmers(self):
+        assert len(best_reference.minimizers("N" * 50)) == 0
+
+
+class TestRankReferences:
+    def test_best_reference(self, panel_file, tmpdir):
+        panel, references = panel_file
+        index_file = str(tmpdir.join("index.npz"))
+        index = best_reference.load_index(panel, index_file)
+        contigs = [references[1][20:250],
+                   reverse_complement(references[1][300:550])]
+
+        ranking = best_reference.rank_references(contigs, index)
+
+        assert ranking[0][0] == "ref1"
+        assert ranking[0][1] == pytest.approx(1)
+        assert ranking[1][1] < 0.2
+
+    def test_index_rebuilt_when_panel_changes(self, panel_file, tmpdir):
+        panel, references = panel_file
+        index_file = str(tmpdir.join("index.npz"))
+        best_reference.load_index(panel, index_file)
+        with open(panel, "a") as panel_fasta:
+            panel_fasta.write(">ref3\n{}\n".format(references[0][::-1]))
+
+        index = best_reference.load_index(panel, index_file)
+
+        assert index['names'].tolist() == ["ref0", "ref1", "ref2", "ref3"]
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from scripts import downsample_fastq
+from scripts.frequency_store import record_dtype
+
+
+def fastq_lines(names, mate):
+    lines = []
+    for name in names:
+        lines += ["@{}/{} extra\n".format(name, mate), "ACGT\n", "+\n",
+                  "IIII\n"]
+    return lines
+
+
+names = ["read{}".format(number) for number in range(100)]
+
+
+class TestReadPairs:
+    def test_pairs(self):
+        pairs = list(downsample_fastq.read_pairs(fastq_lines(names, 1),
+                                                 fastq_lines(names, 2)))
+
+        assert len(pairs) == 100
+        assert pairs[0][0][0] == "@read0/1 extra\n"
+        assert pairs[0][1][0] == "@read0/2 extra\n"
+
+    def test_out_of_sync(self):
+        with pytest.raises(ValueError):
+            list(downsample_fastq.read_pairs(fastq_lines(names, 1),
+                                             fastq_lines(names[1:], 2)))
+
+    def test_truncated(self):
+        with pytest.raises(ValueError):
+            list(downsample_fastq.read_pairs(fastq_lines(names, 1)[:-1],
+                                             fastq_lines(names, 2)[:-1]))
+
+
+class TestSampling:
+    def pairs(self):
+        return downsample_fastq.read_pairs(fastq_lines(names, 1),
+                                           fastq_lines(names, 2))
+
+    def test_reservoir_count_and_order(self):
+        sampled = downsample_fastq.reservoir_sample(self.pairs(), 10, seed=3)
+        sampled_names = [downsample_fastq.read_name(pair[0][0])
+                         for pair in sampled]
+
+        assert len(sampled) == 10
+        assert sampled_names == sorted(sampled_names,
+                                       key=lambda name: int(name[4:]))
+        assert all(downsample_fastq.read_name(pair[0][0]) ==
+                   downsample_fastq.read_name(pair[1][0])
+                   for pair in sampled)
+
+    def test_reservoir_seeded(self):
+        assert (downsample_fastq.reservoir_sample(self.pairs(), 10, seed=3) ==
+                downsample_fastq.reservoir_sample(self.pairs(), 10, seed=3))
+
+    def test_reservoir_more_than_input(self):
+        assert len(downsample_fastq.reservoir_sample(self.pairs(), 500)) == 100
+
+    def test_hash_sample_deterministic(self):
+        first = list(downsample_fastq.hash_sample(self.pairs(), 0.3))
+        second = list(downsample_fastq.hash_sample(self.pairs(), 0.3))
+
+        assert first == second
+        assert 0 < len(first) < 100
+
+    def test_hash_sample_all(self):
+        assert len(list(downsample_fastq.hash_sample(self.pairs(), 1))) == 100
+
+
+def test_pairs_for_depth():
+    assert downsample_fastq.pairs_for_depth(1000, 9646, 150) == 32154
+
+
+def test_frequency_error():
+    full = np.zeros(3, dtype=record_dtype)
+    full['Pos'] = [1, 2, 3]
+    full['A'] = [100, 90, 50]
+    full['C'] = [0, 10, 50]
+    full['Depth'] = 10000
+    downsampled = full.copy()[1:]
+    downsampled['A'] = [88, 50]
+    downsampled['C'] = [12, 50]
+    downsampled['Depth'] = 1000
+
+    summary = downsample_fastq.frequency_error(full, downsampled)
+
+    assert summary['positions'] == 2
+    assert summary['downsampled_depth'] == 1000
+    assert summary['max_abs_error'] == pytest.approx(2)
+    assert summary['mean_abs_error'] == pytest.approx(0.4)
+    assert summary['positions_over_1pc'] == 1
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from scripts import frequency_store
+
+
+matrix_tsv = ("Pos\tA\tC\tG\tT\tGap\tDepth\tRefN\n"
+              "1\t33.33\t66.67\t0\t0\t0.0\t3\tC\n"
+              "2\t100.0\t0\t0\t0\t0.0\t3\tA\n"
+              "3\t0\t0\t50.0\t0\t50.0\t4\tG\n"
+              "4\t0\t0\t0\t100.0\t0.0\t3\tT\n")
+
+
+@pytest.fixture
+def matrix_file(tmpdir):
+    matrix = tmpdir.join("171009_1_quasi_frequency_matrix.txt")
+    matrix.write(matrix_tsv)
+    return str(matrix)
+
+
+class TestReadFrequencyMatrix:
+    def test_fields(self, matrix_file):
+        records = frequency_store.read_frequency_matrix(matrix_file)
+
+        assert list(records['Pos']) == [1, 2, 3, 4]
+        assert list(records['Depth']) == [3, 3, 4, 3]
+        assert list(records['RefN']) == [b'C', b'A', b'G', b'T']
+        assert records['C'][0] == pytest.approx(66.67)
+
+    def test_extra_quasibam_columns(self, tmpdir):
+        quasibam = tmpdir.join("171009_1_vicuna_bwa_quasibam.txt")
+        quasibam.write("Pos\tRefN\tCons\tA\tC\tG\tT\tGap\tDepth\t\n"
+                       "1\ta\tA\t99.5\t0.5\t0\t0\t0\t200\t\n")
+
+        records = frequency_store.read_frequency_matrix(str(quasibam))
+
+        assert records['A'][0] == pytest.approx(99.5)
+        assert records['Depth'][0] == 200
+        assert records['RefN'][0] == b'a'
+
+    def test_round_trip(self, tmpdir):
+        matrix = tmpdir.join("171009_1_quasi_frequency_matrix.txt")
+        matrix.write(matrix_tsv +
+                     "5\t7.41\t11.11\t14.81\t18.52\t48.15\t27\tGap\n")
+        output = tmpdir.join("output.txt")
+        records = frequency_store.read_frequency_matrix(str(matrix))
+        frequency_store.write_frequency_matrix(str(output), records)
+
+        assert np.array_equal(
+            frequency_store.read_frequency_matrix(str(output)), records)
+        assert output.readlines()[-1].rstrip().endswith("\tGap")
+
+
+class TestFrequencyStore:
+    def test_query(self, matrix_file, tmpdir):
+        store_file = str(tmpdir.join("store.fms"))
+        records = frequency_store.read_frequency_matrix(matrix_file)
+        frequency_store.write_store(store_file, {'171009_1': records,
+                                                 '171009_2': records[:2]})
+
+        with frequency_store.FrequencyStore(store_file) as store:
+            assert store.samples == ['171009_1', '171009_2']
+            assert list(store.query('171009_1', 2, 3)['Pos']) == [2, 3]
+            assert list(store.query('171009_2', 2, 10)['Pos']) == [2]
+            assert len(store.query('171009_2', 5, 10)) == 0
+            assert np.array_equal(store.sample('171009_1'), records)
+
+    def test_unsorted_positions(self, matrix_file, tmpdir):
+        store_file = str(tmpdir.join("store.fms"))
+        records = frequency_store.read_frequency_matrix(matrix_file)
+        frequency_store.write_store(store_file, {'171009_1': records[::-1]})
+
+        with frequency_store.FrequencyStore(store_file) as store:
+            assert list(store.query('171009_1', 1, 4)['Pos']) == [1, 2, 3, 4]
+
+    def test_not_a_store(self, matrix_file):
+        with pytest.raises(ValueError):
+            frequency_store.FrequencyStore(matrix_file)
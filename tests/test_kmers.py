@@ -0,0 +1,24 @@
+import numpy as np
+
+from scripts import kmers
+
+
+class TestWindows:
+    def test_runs(self):
+        assert kmers.windows(np.arange(4), 2).tolist() == [[0, 1], [1, 2],
+                                                           [2, 3]]
+
+
+class TestForwardKmers:
+    def test_values(self):
+        values, valid = kmers.forward_kmers(
+            kmers.sequence_codes("ACGtN"), 3)
+
+        # ACG = 00 01 10, CGT = 01 10 11
+        assert values[:2].tolist() == [6, 27]
+        assert valid.tolist() == [True, True, False]
+
+    def test_shorter_than_k(self):
+        values, valid = kmers.forward_kmers(kmers.sequence_codes("AC"), 3)
+
+        assert len(values) == 0 and len(valid) == 0
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from scripts import vphaser_aggregate
+from scripts.frequency_store import read_frequency_matrix
+
+
+var_header = ("# Ref_Pos\tVar\tCons\tStrd_bias_pval\tType\tVar_perc\t"
+              "SNP_or_LP_Profile\n")
+
+
+@pytest.fixture
+def data_directory(tmpdir):
+    sample_1 = tmpdir.mkdir("vphaser").mkdir("171009_1")
+    sample_1.join("consensus.fdr.var.txt").write(
+        var_header +
+        "2\tG\tA\t0.5\tsnp\t12.5\tA:70 G:10\n"
+        "3\tT\tC\t0.2\tsnp\t3.0\tC:97 T:3\n"
+        "#Summary line\n"
+        "4\tD2\tI\t0.9\tlp\t1.5\tI:98 D2:2\n")
+    tmpdir.join("vphaser").mkdir("171009_2").join(
+        "consensus.fdr.var.txt").write(
+        var_header + "1\tC\tA\t0.1\tsnp\t0.5\tA:199 C:1\n")
+    tmpdir.join("171009_1_quasi_frequency_matrix.txt").write(
+        "Pos\tA\tC\tG\tT\tGap\tDepth\tRefN\n"
+        "1\t100.0\t0\t0\t0\t0\t10\tA\n"
+        "2\t85.0\t0\t15.0\t0\t0\t10\tA\n"
+        "3\t0\t99.0\t0\t0\t1.0\t10\tC\n"
+        "4\t0\t0\t60.0\t40.0\t0\t10\tG\n")
+    return tmpdir
+
+
+class TestParseVphaser:
+    def test_columns(self, data_directory):
+        variants = vphaser_aggregate.parse_vphaser(
+            str(data_directory.join("vphaser", "171009_1")))
+
+        assert variants['position'] == [2, 3, 4]
+        assert variants['allele'] == ['G', 'T', 'D2']
+        assert variants['type'] == ['snp', 'snp', 'lp']
+        assert variants['frequency'] == [12.5, 3.0, 1.5]
+        assert set(variants['sample']) == {'171009_1'}
+
+
+class TestAggregateVphaser:
+    def test_all_samples(self, data_directory):
+        called = vphaser_aggregate.aggregate_vphaser(
+            [str(data_directory.join("vphaser", sample))
+             for sample in ["171009_1", "171009_2"]], processes=2)
+
+        assert called['sample'].tolist() == ['171009_1'] * 3 + ['171009_2']
+        assert called['position'].dtype == np.int64
+
+
+class TestScoreVariants:
+    def test_sensitivity_precision(self, data_directory):
+        called = vphaser_aggregate.aggregate_vphaser(
+            [str(data_directory.join("vphaser", sample))
+             for sample in ["171009_1", "171009_2"]], processes=1)
+        known = vphaser_aggregate.known_variants(
+            {'171009_1': read_frequency_matrix(str(data_directory.join(
+                "171009_1_quasi_frequency_matrix.txt")))})
+
+        assert sorted(zip(known['position'].tolist(),
+                          known['allele'].tolist())) == [(2, 'G'), (4, 'T')]
+
+        summary = vphaser_aggregate.score_variants(called, known,
+                                                   bins=(0, 5, 20, 100))
+
+        # 171009_2 has no frequency matrix and lp calls aren't scored
+        assert summary['known_variants'].tolist() == [0, 1, 1]
+        assert summary['detected'].tolist() == [0, 1, 0]
+        assert summary['calls'].tolist() == [1, 1, 0]
+        assert summary['true_calls'].tolist() == [0, 1, 0]
+        np.testing.assert_allclose(summary['sensitivity'],
+                                   [np.nan, 1, 0])
+        np.testing.assert_allclose(summary['precision'], [0, 1, np.nan])